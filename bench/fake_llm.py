@@ -0,0 +1,198 @@
+"""
+Replayable chat model for offline agent benchmarks
+
+ReplayChatModel answers from a recordings file instead of calling Groq:
+one JSON object per line with the user message and the model's reply,
+
+    {"message": "Any books by Robert Martin?", "content": "TOOL: find_books(q=\\"Robert Martin\\", by=\\"author\\")"}
+    {"message": "...", "content": "", "tool_calls": [{"name": "order_status", "args": {"order_id": 2}}]}
+
+`content` replays text (including TOOL: lines); `tool_calls` replays native
+tool calls. RecordingChatModel wraps a real model and writes such a file.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+sys.path.insert(0, str(Path(__file__).parent))
+import harness
+
+harness.use_server_path()
+from context import count_tokens
+
+
+RECORDINGS_PATH = Path(__file__).parent / "recordings" / "desk.jsonl"
+
+# Reply after tool results are fed back (multi-round turns)
+FOLLOW_UP = "Done."
+DEFAULT_REPLY = "I can search books, place and check orders, manage stock and prices, and run sales reports."
+
+
+def message_key(text: str) -> str:
+    return " ".join(re.findall(r"\w+", str(text).lower()))
+
+
+def load_recordings(path=RECORDINGS_PATH) -> Dict[str, Dict]:
+    """Recorded replies keyed by normalized user message; later lines win"""
+    recordings = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings[message_key(entry['message'])] = entry
+    return recordings
+
+
+def recorded_messages(path=RECORDINGS_PATH) -> List[str]:
+    """User messages in file order, for driving sessions"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)['message'] for line in f if line.strip()]
+
+
+def _last_message(messages: List[BaseMessage]) -> Optional[BaseMessage]:
+    return messages[-1] if messages else None
+
+
+def _usage(messages: List[BaseMessage], reply: str) -> Dict:
+    prompt = sum(count_tokens(m.content if isinstance(m.content, str) else str(m.content))
+                 for m in messages)
+    completion = count_tokens(reply)
+    return {'input_tokens': prompt, 'output_tokens': completion,
+            'total_tokens': prompt + completion}
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model that replays recorded replies with simulated latency.
+
+    latency is the time to the first token and token_delay the pause
+    between streamed chunks of chunk_size characters; jitter scales both by
+    a random factor in [1 - jitter, 1 + jitter] (seeded, so runs repeat).
+    Tools passed to bind_tools are accepted and ignored.
+    """
+
+    recordings: Dict[str, Dict] = {}
+    latency: float = 0.0
+    token_delay: float = 0.0
+    chunk_size: int = 8
+    jitter: float = 0.0
+    seed: int = 0
+    default_reply: str = DEFAULT_REPLY
+
+    _random: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default=None)
+    _calls: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context):
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _scale(self, seconds: float) -> float:
+        if not seconds or not self.jitter:
+            return seconds
+        with self._lock:
+            factor = self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0.0, seconds * factor)
+
+    def _reply(self, messages: List[BaseMessage]) -> Dict:
+        with self._lock:
+            self._calls += 1
+        last = _last_message(messages)
+        if not isinstance(last, HumanMessage):
+            return {'content': FOLLOW_UP}
+        return self.recordings.get(message_key(last.content)) or {'content': self.default_reply}
+
+    def _tool_calls(self, entry: Dict) -> List[Dict]:
+        return [
+            {'name': call['name'], 'args': call.get('args', {}), 'id': f"call_{i}", 'type': 'tool_call'}
+            for i, call in enumerate(entry.get('tool_calls') or [])
+        ]
+
+    def _message(self, messages, entry) -> AIMessage:
+        content = entry.get('content') or ""
+        return AIMessage(content=content, tool_calls=self._tool_calls(entry),
+                         usage_metadata=_usage(messages, content))
+
+    def _delay(self, content: str) -> float:
+        chunks = max(1, -(-len(content) // self.chunk_size))
+        return self._scale(self.latency) + self._scale(self.token_delay) * (chunks - 1)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._message(messages, self._reply(messages))
+        time.sleep(self._delay(message.content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._message(messages, self._reply(messages))
+        await asyncio.sleep(self._delay(message.content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        entry = self._reply(messages)
+        content = entry.get('content') or ""
+        time.sleep(self._scale(self.latency))
+
+        for start in range(0, len(content), self.chunk_size):
+            if start:
+                time.sleep(self._scale(self.token_delay))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content[start:start + self.chunk_size]))
+
+        for i, call in enumerate(self._tool_calls(entry)):
+            time.sleep(self._scale(self.token_delay))
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                'name': call['name'], 'args': json.dumps(call['args']), 'id': call['id'], 'index': i
+            }]))
+
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata=_usage(messages, content)
+        ))
+
+
+class RecordingChatModel(BaseChatModel):
+    """Passes calls to a real model and appends each first-round reply to path"""
+
+    inner: Any
+    path: str
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def bind_tools(self, tools, **kwargs):
+        return RecordingChatModel(inner=self.inner.bind_tools(tools, **kwargs), path=self.path)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self.inner.invoke(messages)
+        last = _last_message(messages)
+
+        if isinstance(last, HumanMessage):
+            entry = {'message': last.content, 'content': reply.content if isinstance(reply.content, str) else ""}
+            if reply.tool_calls:
+                entry['tool_calls'] = [{'name': tc['name'], 'args': tc['args']} for tc in reply.tool_calls]
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+        return ChatResult(generations=[ChatGeneration(message=reply)])
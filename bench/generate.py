@@ -0,0 +1,265 @@
+"""
+Deterministic synthetic catalogue for benchmarks
+
+The same --seed and --anchor always produce the same rows. Presets:
+
+    small    10k books,   2k customers,   20k orders,   50k order lines
+    medium  100k books,  20k customers,  250k orders,    1M order lines
+    large     1M books, 200k customers,  2.5M orders,   10M order lines
+
+    python bench/generate.py bench/data/small.db
+    python bench/generate.py bench/data/large.db --scale large --anchor 2026-01-31
+"""
+
+import sys
+import time
+import sqlite3
+import argparse
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+import numpy as np
+
+
+SCHEMA_PATH = Path(__file__).parent.parent / "db" / "Schema.sql"
+
+SCALES = {
+    'small': {'books': 10_000, 'customers': 2_000, 'orders': 20_000, 'lines': 50_000},
+    'medium': {'books': 100_000, 'customers': 20_000, 'orders': 250_000, 'lines': 1_000_000},
+    'large': {'books': 1_000_000, 'customers': 200_000, 'orders': 2_500_000, 'lines': 10_000_000},
+}
+
+# Rows per executemany call
+INSERT_CHUNK = 100_000
+
+# Popularity skew of order lines over books (Zipf exponent)
+POPULARITY = 1.2
+
+ADJECTIVES = (
+    "Silent", "Hidden", "Clean", "Practical", "Modern", "Lost", "Broken", "Golden",
+    "Effective", "Distant", "Quiet", "Secret", "Fluent", "Last", "Wild", "Pragmatic",
+    "Crimson", "Forgotten", "Eternal", "Little", "Bright", "Deep", "Northern", "Hollow",
+)
+NOUNS = (
+    "Code", "River", "Garden", "Python", "Kingdom", "Patterns", "Ocean", "Machine",
+    "Design", "Forest", "Empire", "Algorithms", "Mountain", "Letters", "Data", "City",
+    "Shadow", "Systems", "Harbor", "Compiler", "Winter", "Network", "Island", "Library",
+)
+SUBJECTS = (
+    "Time", "the Night", "Tomorrow", "Databases", "the Sea", "Strangers", "Fire",
+    "Small Things", "Software", "the North", "Memory", "Glass", "Machines", "Light",
+)
+FIRST_NAMES = (
+    "Alice", "Robert", "Maria", "James", "Chen", "Fatima", "Luca", "Amara", "Eric",
+    "Sofia", "Kenji", "Olga", "Diego", "Priya", "Noah", "Ingrid", "Tariq", "Helen",
+    "Mateo", "Yuki", "Grace", "Samuel", "Leila", "Victor", "Nadia", "Oscar", "Zoe",
+)
+LAST_NAMES = (
+    "Martin", "Hunt", "Bloch", "Evans", "Brooks", "Ramalho", "Nakamura", "Okafor",
+    "Rossi", "Novak", "Garcia", "Larsen", "Haddad", "Kowalski", "Silva", "Ivanova",
+    "Freeman", "Matthes", "Costa", "Andersen", "Mensah", "Dubois", "Park", "Weber",
+)
+
+
+def _pick(rng, words, n) -> np.ndarray:
+    return np.asarray(words, dtype=object)[rng.integers(0, len(words), n)]
+
+
+def _timestamps(anchor: date, seconds: np.ndarray) -> list:
+    """SQLite CURRENT_TIMESTAMP-style strings for seconds before anchor's end"""
+    end = np.datetime64(anchor + timedelta(days=1), 's')
+    stamps = np.datetime_as_string(end - seconds.astype('timedelta64[s]'), unit='s')
+    return [s.replace('T', ' ') for s in stamps.tolist()]
+
+
+def _insert(conn, sql: str, rows: Iterable[tuple], total: int, label: str, quiet: bool):
+    """executemany in INSERT_CHUNK slices with a progress line"""
+    done = 0
+    rows = iter(rows)
+    while True:
+        chunk = [row for _, row in zip(range(INSERT_CHUNK), rows)]
+        if not chunk:
+            break
+        conn.executemany(sql, chunk)
+        done += len(chunk)
+        if not quiet:
+            print(f"\r  {label}: {done}/{total}", end="", file=sys.stderr, flush=True)
+    if not quiet:
+        print(file=sys.stderr)
+
+
+def _suspend(conn, tables) -> list:
+    """Drop triggers and secondary indexes on the bulk-loaded tables.
+
+    Returns their stored definitions so they can be re-created (and the
+    indexes built in one sorted pass) once the rows are in.
+    """
+    rows = conn.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('trigger', 'index') AND sql IS NOT NULL
+          AND tbl_name IN ({', '.join('?' for _ in tables)})
+    """, tuple(tables)).fetchall()
+    for kind, name, _ in rows:
+        conn.execute(f'DROP {kind.upper()} "{name}"')
+    return [sql for _, _, sql in rows]
+
+
+def generate(path, books: int, customers: int, orders: int, lines: int,
+             days: int = 365, sessions: int = 200, messages: int = 20,
+             seed: int = 42, anchor: Optional[date] = None, quiet: bool = False) -> Dict:
+    """Build a fresh database at path and return its row counts.
+
+    Orders are spread over the `days` days ending on `anchor` (default:
+    today, UTC), in id order, so date-range reports have realistic data.
+    Order lines favour a few popular books, like real sales.
+    """
+    path = Path(path)
+    if path.exists():
+        raise FileExistsError(f"{path} already exists")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    anchor = anchor or datetime.now(timezone.utc).date()
+    rng = np.random.default_rng(seed)
+    orders = max(1, min(orders, lines))
+    start = time.perf_counter()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Throwaway file until it is complete, so skip the journal entirely
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-262144")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.executescript(SCHEMA_PATH.read_text())
+
+        conn.execute("BEGIN")
+        deferred = _suspend(conn, ('books', 'customers', 'orders', 'order_items'))
+        created = f"{anchor - timedelta(days=days)} 09:00:00"
+
+        # Books
+        isbns = [f"979{n:010d}" for n in range(1, books + 1)]
+        titles = _pick(rng, ADJECTIVES, books) + " " + _pick(rng, NOUNS, books)
+        with_subject = rng.random(books) < 0.4
+        titles[with_subject] += " of " + _pick(rng, SUBJECTS, int(with_subject.sum()))
+        authors = _pick(rng, FIRST_NAMES, books) + " " + _pick(rng, LAST_NAMES, books)
+        prices = np.round(rng.uniform(5, 80, books), 2)
+        # Mostly healthy shelves, a few titles at or near zero
+        stock = np.where(rng.random(books) < 0.02, rng.integers(0, 5, books),
+                         rng.integers(5, 200, books))
+        _insert(conn, "INSERT INTO books (isbn, title, author, price, stock, created_at, book_id) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                zip(isbns, titles.tolist(), authors.tolist(), prices.tolist(), stock.tolist(),
+                    [created] * books, range(1, books + 1)),
+                books, "books", quiet)
+
+        # Customers
+        names = _pick(rng, FIRST_NAMES, customers) + " " + _pick(rng, LAST_NAMES, customers)
+        _insert(conn, "INSERT INTO customers (id, name, email, created_at) VALUES (?, ?, ?, ?)",
+                ((n, name, f"customer{n}@example.com", created)
+                 for n, name in enumerate(names.tolist(), 1)),
+                customers, "customers", quiet)
+
+        # Order lines: every order gets one, the rest land on random orders
+        order_of_line = np.sort(np.concatenate([
+            np.arange(orders), rng.integers(0, orders, lines - orders)
+        ]))
+        ranked = rng.permutation(books)
+        book_of_line = ranked[(rng.zipf(POPULARITY, lines) - 1) % books]
+        quantity = 1 + rng.poisson(0.4, lines)
+        line_price = prices[book_of_line]
+        totals = np.round(np.bincount(order_of_line, weights=quantity * line_price,
+                                      minlength=orders), 2)
+
+        # Orders, oldest first
+        placed = np.sort(rng.integers(0, days * 86400, orders))[::-1]
+        _insert(conn, "INSERT INTO orders (id, customer_id, total_amount, status, created_at) "
+                      "VALUES (?, ?, ?, 'completed', ?)",
+                zip(range(1, orders + 1), rng.integers(1, customers + 1, orders).tolist(),
+                    totals.tolist(), _timestamps(anchor, placed)),
+                orders, "orders", quiet)
+
+        isbn_array = np.asarray(isbns, dtype=object)
+        _insert(conn, "INSERT INTO order_items (order_id, isbn, quantity, price_at_purchase) "
+                      "VALUES (?, ?, ?, ?)",
+                zip((order_of_line + 1).tolist(), isbn_array[book_of_line].tolist(),
+                    quantity.tolist(), line_price.tolist()),
+                lines, "order lines", quiet)
+
+        # Derived tables in one set-based pass each, then triggers and indexes back
+        if not quiet:
+            print("  rebuilding indexes and derived tables", file=sys.stderr)
+        conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        conn.execute("""
+            INSERT OR REPLACE INTO inventory_stats (id, total_titles, total_books, total_value)
+            SELECT 1, COUNT(*), COALESCE(SUM(stock), 0), COALESCE(SUM(stock * price), 0)
+            FROM books
+        """)
+        conn.execute("DELETE FROM sales_daily")
+        conn.execute("""
+            INSERT INTO sales_daily (day, isbn, quantity, revenue, order_lines)
+            SELECT date(o.created_at), oi.isbn, SUM(oi.quantity),
+                   SUM(oi.quantity * oi.price_at_purchase), COUNT(*)
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            GROUP BY date(o.created_at), oi.isbn
+        """)
+        for sql in deferred:
+            conn.execute(sql)
+
+        # Chat sessions, through the normal trigger (small)
+        session_rows = []
+        for s in range(sessions):
+            for m in range(messages):
+                role = "user" if m % 2 == 0 else "assistant"
+                stamp = f"{anchor} {8 + m // 6:02d}:{(m * 7) % 60:02d}:{s % 60:02d}"
+                session_rows.append((f"bench-{s:05d}", role, f"{role} message {m}", stamp))
+        _insert(conn, "INSERT INTO messages (session_id, role, content, created_at) "
+                      "VALUES (?, ?, ?, ?)",
+                session_rows, len(session_rows), "messages", quiet)
+
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode=WAL")
+    except BaseException:
+        conn.close()
+        path.unlink(missing_ok=True)
+        raise
+    conn.close()
+
+    counts = {'books': books, 'customers': customers, 'orders': orders, 'order_lines': lines,
+              'sessions': sessions, 'messages': sessions * messages}
+    if not quiet:
+        print(f"Generated {counts} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return counts
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic library database")
+    parser.add_argument("path")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--books", type=int)
+    parser.add_argument("--customers", type=int)
+    parser.add_argument("--orders", type=int)
+    parser.add_argument("--lines", type=int, help="order lines")
+    parser.add_argument("--days", type=int, default=365, help="days of order history")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--anchor", type=date.fromisoformat,
+                        help="last day of order history (default: today, UTC)")
+    parser.add_argument("--force", action="store_true", help="replace an existing file")
+    args = parser.parse_args(argv)
+
+    sizes = dict(SCALES[args.scale])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+
+    path = Path(args.path)
+    if path.exists() and args.force:
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+    generate(path, days=args.days, seed=args.seed, anchor=args.anchor, **sizes)
+
+
+if __name__ == "__main__":
+    main()
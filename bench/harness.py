@@ -0,0 +1,208 @@
+"""
+Timing, result files and baseline comparison shared by the bench scripts
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import tempfile
+import platform
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+ROOT = Path(__file__).parent.parent
+SERVER_DIR = ROOT / "server"
+
+# A result this much slower than its baseline counts as a regression
+REGRESSION_THRESHOLD = 0.25
+# Latency differences smaller than this are timer noise, whatever the ratio
+NOISE_FLOOR_MS = 0.02
+
+
+def use_server_path():
+    """Make the server modules importable the way the app does"""
+    if str(SERVER_DIR) not in sys.path:
+        sys.path.insert(0, str(SERVER_DIR))
+
+
+def copy_database(source, target):
+    """Consistent copy of a (possibly WAL-mode) database"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def working_database(source=None):
+    """A throwaway database for one run: a copy of source, or a new file.
+
+    Returns (temporary directory, path); the directory's cleanup() deletes
+    it. A new file gets the schema and seed data from init_database().
+    """
+    workdir = tempfile.TemporaryDirectory(prefix="library-bench-")
+    path = Path(workdir.name) / (Path(source).name if source else "library.db")
+    if source:
+        copy_database(source, path)
+    return workdir, path
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = math.ceil(q / 100 * len(ordered))
+    return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+def summarize(samples_ms: List[float], seconds: Optional[float] = None,
+              kind: str = "latency", **extra) -> Dict:
+    """Latency percentiles for a list of per-call milliseconds.
+
+    seconds is the wall time the samples took together (concurrent runs);
+    by default the calls are assumed to have run one after another.
+    """
+    ordered = sorted(samples_ms)
+    n = len(ordered)
+    total = sum(ordered)
+    if seconds is None:
+        seconds = total / 1000
+    result = {
+        'kind': kind,
+        'n': n,
+        'mean_ms': round(total / n, 4) if n else 0.0,
+        'p50_ms': round(percentile(ordered, 50), 4),
+        'p95_ms': round(percentile(ordered, 95), 4),
+        'p99_ms': round(percentile(ordered, 99), 4),
+        'min_ms': round(ordered[0], 4) if n else 0.0,
+        'max_ms': round(ordered[-1], 4) if n else 0.0,
+        'ops_per_sec': round(n / seconds, 1) if seconds else 0.0
+    }
+    result.update(extra)
+    return result
+
+
+def measure(fn: Callable[[int], object], repeat: int, warmup: int = 3,
+            setup: Optional[Callable[[], object]] = None) -> Dict:
+    """Call fn(i) repeat times (after warmup calls) and summarize the timings.
+
+    setup() runs before every call, outside the timed region - e.g. to
+    clear a cache for a cold-path measurement.
+    """
+    for i in range(warmup):
+        if setup:
+            setup()
+        fn(i)
+
+    samples = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> Dict:
+    """Where the numbers came from, stored alongside them"""
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def save(path, meta: Dict, results: Dict[str, Dict]):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict],
+            threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+    """Per-benchmark change against a baseline run.
+
+    Latency results compare p50; throughput results compare ops/s. `change`
+    is positive when the new run is worse.
+    """
+    rows = []
+    for name in sorted(set(results) & set(baseline)):
+        new, old = results[name], baseline[name]
+        if new.get('kind') == 'throughput':
+            metric, before, after = 'ops_per_sec', old['ops_per_sec'], new['ops_per_sec']
+            change = before / after - 1 if after else float('inf')
+        else:
+            metric, before, after = 'p50_ms', old['p50_ms'], new['p50_ms']
+            change = after / before - 1 if before else 0.0
+
+        if metric == 'p50_ms' and abs(after - before) < NOISE_FLOOR_MS:
+            status = 'same'
+        elif change > threshold:
+            status = 'regressed'
+        elif change < -threshold:
+            status = 'improved'
+        else:
+            status = 'same'
+        rows.append({'name': name, 'metric': metric, 'baseline': before, 'current': after,
+                     'change': round(change, 4), 'status': status})
+    return rows
+
+
+def print_results(results: Dict[str, Dict], out=sys.stdout):
+    width = max((len(name) for name in results), default=10)
+    print(f"{'benchmark':<{width}}  {'n':>6}  {'p50 ms':>10}  {'p95 ms':>10}  "
+          f"{'p99 ms':>10}  {'ops/s':>10}", file=out)
+    for name, r in results.items():
+        print(f"{name:<{width}}  {r['n']:>6}  {r['p50_ms']:>10.3f}  {r['p95_ms']:>10.3f}  "
+              f"{r['p99_ms']:>10.3f}  {r['ops_per_sec']:>10.1f}", file=out)
+
+
+def print_comparison(rows: List[Dict], out=sys.stdout):
+    if not rows:
+        print("No benchmarks in common with the baseline", file=out)
+        return
+    width = max(len(row['name']) for row in rows)
+    for row in rows:
+        flag = {'regressed': '  <-- slower', 'improved': '  faster'}.get(row['status'], '')
+        print(f"{row['name']:<{width}}  {row['metric']:<11}  {row['baseline']:>10.3f} -> "
+              f"{row['current']:>10.3f}  {row['change']:+7.1%}{flag}", file=out)
+
+
+def check_baseline(results: Dict[str, Dict], path, threshold: float = REGRESSION_THRESHOLD) -> bool:
+    """Print the comparison with a saved results file; False if anything regressed"""
+    rows = compare(results, load(path)['results'], threshold)
+    print(f"\nAgainst {path} (threshold {threshold:.0%}):")
+    print_comparison(rows)
+    regressed = [row['name'] for row in rows if row['status'] == 'regressed']
+    if regressed:
+        print(f"\n{len(regressed)} regression(s): {', '.join(regressed)}")
+    return not regressed
@@ -0,0 +1,220 @@
+"""
+End-to-end agent load test with a replayed model (no network, no API key)
+
+Runs N simulated desk sessions at once, each sending the recorded desk
+messages through LibraryAgent, and reports per-turn latency and throughput.
+
+    python bench/load.py                                  # 20 sessions x 20 turns, chat()
+    python bench/load.py --mode ui --sessions 8           # through TerminalUI.handle_command
+    python bench/load.py --mode async --latency 0.4 --token-delay 0.01 --jitter 0.3
+    python bench/load.py --model-only --out bench/results/agent.json
+    python bench/load.py --baseline bench/results/agent.json
+
+Modes: "agent" calls LibraryAgent.chat from one thread per session,
+"async" awaits LibraryAgent.achat for every session on one event loop (as
+the desk server does), and "ui" feeds main.py's TerminalUI line by line,
+including 'sessions' and 'history' commands, with output discarded.
+
+To capture fresh replies from Groq instead: --record FILE (needs GROQ_API_KEY).
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+import harness
+
+
+# Terminal commands mixed into "ui" sessions, one every this many turns
+COMMAND_EVERY = 5
+
+
+def session_script(messages: List[str], index: int, turns: int, mode: str) -> List[str]:
+    """The lines one session sends: recorded messages, rotated per session"""
+    script = []
+    for turn in range(turns):
+        if mode == "ui" and turn and turn % COMMAND_EVERY == 0:
+            script.append("history" if (turn // COMMAND_EVERY) % 2 else "sessions")
+        script.append(messages[(index + turn) % len(messages)])
+    return script
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Load-test LibraryAgent with a replayed model")
+    parser.add_argument("--mode", choices=("agent", "async", "ui"), default="agent")
+    parser.add_argument("--sessions", type=int, default=20, help="simulated desks")
+    parser.add_argument("--turns", type=int, default=20, help="messages per session")
+    parser.add_argument("--concurrency", type=int, help="sessions running at once (default: all)")
+    parser.add_argument("--latency", type=float, default=0.0, help="model time to first token, seconds")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- fraction on model delays")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recordings", default=None, help="recorded replies (default bench/recordings/desk.jsonl)")
+    parser.add_argument("--model-only", action="store_true",
+                        help="send every turn to the model (bypass the intent router and plan cache)")
+    parser.add_argument("--db", help="database to copy for the run (default: a fresh seeded one)")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a results file from an earlier run")
+    parser.add_argument("--threshold", type=float, default=harness.REGRESSION_THRESHOLD)
+    parser.add_argument("--record", metavar="FILE",
+                        help="call Groq for every recorded message once and append its replies to FILE")
+    args = parser.parse_args(argv)
+
+    workdir, path = harness.working_database(args.db)
+
+    # The app's modules bind the database at import time
+    os.environ["LIBRARY_DB"] = str(path)
+    harness.use_server_path()
+    import fake_llm
+    from agent_groq import LibraryAgent
+    from runtime import AgentRuntime
+    from router import ROUTER
+    from log_writer import LOG_WRITER
+    from database import db
+    # main.py lives at the repository root
+    sys.path.insert(0, str(harness.ROOT))
+    from main import TerminalUI
+
+    recordings = args.recordings or fake_llm.RECORDINGS_PATH
+    messages = fake_llm.recorded_messages(recordings)
+
+    if args.record:
+        from dotenv import load_dotenv
+        load_dotenv()
+        runtime = AgentRuntime()
+        runtime._llm = fake_llm.RecordingChatModel(inner=runtime.llm, path=args.record)
+    else:
+        model = fake_llm.ReplayChatModel(
+            recordings=fake_llm.load_recordings(recordings), latency=args.latency,
+            token_delay=args.token_delay, jitter=args.jitter, seed=args.seed
+        )
+        runtime = AgentRuntime(llm=model)
+
+    class ModelOnlyAgent(LibraryAgent):
+        def _local_plan(self, msg):
+            return None
+
+    agent_class = ModelOnlyAgent if args.model_only or args.record else LibraryAgent
+    make_agent = partial(agent_class, runtime=runtime)
+
+    sessions = 1 if args.record else args.sessions
+    turns = len(messages) if args.record else args.turns
+    concurrency = max(1, args.concurrency or sessions)
+    scripts = [session_script(messages, i, turns, args.mode) for i in range(sessions)]
+
+    chat_ms, command_ms, errors = [], [], []
+
+    def timed(samples, fn, *fn_args):
+        start = time.perf_counter()
+        try:
+            reply = fn(*fn_args)
+            if isinstance(reply, str) and reply.startswith("Error:"):
+                errors.append(reply)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        samples.append((time.perf_counter() - start) * 1000)
+
+    def run_agent(index):
+        agent = make_agent(session_id=f"load-{index:04d}")
+        for line in scripts[index]:
+            timed(chat_ms, agent.chat, line)
+
+    def run_ui(index):
+        ui = TerminalUI(read=lambda prompt="": "q", agent_factory=make_agent)
+        ui.open_session(f"load-{index:04d}", load=False)
+        for line in scripts[index]:
+            is_command = line in ("sessions", "history")
+            timed(command_ms if is_command else chat_ms, ui.handle_command, line)
+
+    async def run_async():
+        gate = asyncio.Semaphore(concurrency)
+
+        async def session(index):
+            async with gate:
+                agent = make_agent(session_id=f"load-{index:04d}")
+                for line in scripts[index]:
+                    start = time.perf_counter()
+                    reply = await agent.achat(line)
+                    chat_ms.append((time.perf_counter() - start) * 1000)
+                    if reply.startswith("Error:"):
+                        errors.append(reply)
+
+        await asyncio.gather(*(session(i) for i in range(sessions)))
+
+    db.init_database()
+    llm_before = (ROUTER.llm_calls, ROUTER.llm_seconds)
+    print(f"  {sessions} session(s) x {turns} turn(s), mode {args.mode}, "
+          f"concurrency {concurrency}", file=sys.stderr)
+
+    start = time.perf_counter()
+    try:
+        # Replies and UI output are not part of the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if args.mode == "async":
+                asyncio.run(run_async())
+            else:
+                target = run_ui if args.mode == "ui" else run_agent
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    list(pool.map(target, range(sessions)))
+        seconds = time.perf_counter() - start
+        LOG_WRITER.flush()
+        llm_after = (ROUTER.llm_calls, ROUTER.llm_seconds)
+        writer_stats, log_stats = db.write_stats(), LOG_WRITER.stats()
+    finally:
+        LOG_WRITER.close()
+        db.close()
+        workdir.cleanup()
+
+    if args.record:
+        print(f"Recorded {len(chat_ms)} replies to {args.record}")
+        return
+
+    llm_calls = llm_after[0] - llm_before[0]
+    llm_ms = (llm_after[1] - llm_before[1]) * 1000
+    turn_count = len(chat_ms)
+
+    results = {
+        f"{args.mode}.turn": harness.summarize(
+            chat_ms, kind='latency', errors=len(errors), llm_calls=llm_calls,
+            # Time per turn outside the (simulated) model call
+            overhead_ms=round((sum(chat_ms) - llm_ms) / turn_count, 3) if turn_count else 0.0
+        ),
+        f"{args.mode}.throughput": harness.summarize(
+            chat_ms + command_ms, seconds, kind='throughput', sessions=sessions, concurrency=concurrency
+        ),
+    }
+    if command_ms:
+        results[f"{args.mode}.command"] = harness.summarize(command_ms, kind='latency')
+
+    harness.print_results(results)
+    print(f"\n{turn_count} turns in {seconds:.2f}s, {llm_calls} model call(s), "
+          f"{results[f'{args.mode}.turn']['overhead_ms']} ms agent overhead per turn, "
+          f"{len(errors)} error(s)")
+    print(f"db writer: {writer_stats}")
+    print(f"log writer: {log_stats}")
+    for error in dict.fromkeys(errors[:5]):
+        print(f"  {error[:160]}")
+
+    meta = harness.environment()
+    meta.update({
+        'mode': args.mode, 'sessions': sessions, 'turns': turns, 'concurrency': concurrency,
+        'latency': args.latency, 'token_delay': args.token_delay, 'jitter': args.jitter,
+        'model_only': args.model_only, 'database': args.db or 'seed'
+    })
+    if args.out:
+        harness.save(args.out, meta, results)
+        print(f"\nResults written to {args.out}")
+
+    if args.baseline and not harness.check_baseline(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Micro-benchmarks for every Database method and tool, plus concurrent-writer scenarios
+
+Runs against a copy of the given database (see bench/generate.py), so the
+dataset stays the same from run to run.
+
+    python bench/run.py bench/data/small.db --out bench/results/latest.json
+    python bench/run.py bench/data/small.db --baseline bench/results/baseline.json
+    python bench/run.py bench/data/small.db --only find_books,create_order --repeat 500
+
+Exits with status 1 when --baseline is given and something regressed by more
+than --threshold.
+"""
+
+import os
+import sys
+import threading
+import time
+import argparse
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+import harness
+
+
+# Database methods that are plumbing rather than queries
+NOT_BENCHMARKED = {
+    'init_database', 'close', 'get_connection', 'connection', 'write', 'pool_stats',
+    'cache_stats', 'write_stats', 'invalidate_books', 'clear_caches',
+}
+
+# Books, customers, orders and sessions drawn from the dataset for arguments
+SAMPLE_SIZE = 1000
+
+# Copies added to the sampled books so order benchmarks never run dry
+RESTOCK = 1_000_000
+
+
+class Samples:
+    """Deterministic arguments for the benchmarks, drawn from the dataset"""
+
+    def __init__(self, database, seed: int = 7):
+        rng = np.random.default_rng(seed)
+
+        with database.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT MAX(rowid) AS n FROM books")
+            books = cursor.fetchone()['n'] or 0
+            rowids = sorted(set(rng.integers(1, books + 1, SAMPLE_SIZE).tolist()))
+            cursor.execute(
+                f"SELECT isbn, title, author, price FROM books WHERE rowid IN "
+                f"({', '.join(map(str, rowids))}) ORDER BY rowid"
+            )
+            self.books = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute("SELECT MIN(id) AS lo, MAX(id) AS hi FROM customers")
+            row = cursor.fetchone()
+            self.customers = rng.integers(row['lo'], row['hi'] + 1, SAMPLE_SIZE).tolist()
+
+            cursor.execute("SELECT MIN(id) AS lo, MAX(id) AS hi, MAX(created_at) AS last FROM orders")
+            row = cursor.fetchone()
+            self.orders = rng.integers(row['lo'], row['hi'] + 1, SAMPLE_SIZE).tolist()
+            # Reports cover the 30 days up to the newest order, whenever the data was made
+            last = date.fromisoformat(row['last'][:10]) if row['last'] else date.today()
+            self.report_end = last.isoformat()
+            self.report_start = (last - timedelta(days=29)).isoformat()
+
+            cursor.execute("SELECT session_id FROM sessions ORDER BY session_id LIMIT ?",
+                           (SAMPLE_SIZE,))
+            self.sessions = [row['session_id'] for row in cursor.fetchall()] or ['bench']
+
+        if not self.books or not self.customers:
+            raise SystemExit("Dataset needs books and customers; run bench/generate.py first")
+
+        self.isbns = [book['isbn'] for book in self.books]
+        self.titles = [book['title'] for book in self.books]
+        self.authors = [book['author'] for book in self.books]
+        self.words = [book['title'].split()[0] for book in self.books]
+
+    def book(self, i: int) -> Dict:
+        return self.books[i % len(self.books)]
+
+    def isbn(self, i: int) -> str:
+        return self.isbns[i % len(self.isbns)]
+
+    def customer(self, i: int) -> int:
+        return self.customers[i % len(self.customers)]
+
+    def order(self, i: int) -> int:
+        return self.orders[i % len(self.orders)]
+
+    def session(self, i: int) -> str:
+        return self.sessions[i % len(self.sessions)]
+
+    def items(self, i: int, lines: int = 2) -> List[Dict]:
+        return [{'isbn': self.isbn(i * 7 + k), 'qty': 1} for k in range(lines)]
+
+    def report(self) -> Dict:
+        return {'start': self.report_start, 'end': self.report_end}
+
+
+def database_benchmarks(database, s: Samples) -> Dict[str, tuple]:
+    """name -> (fn(i), setup or None, heavy)"""
+    cold = database.clear_caches
+    period = s.report()
+    reservations = []
+
+    def reserve(i):
+        reservations.append(database.reserve_stock(s.items(i, 1))['reservation_id'])
+
+    def release(i):
+        if reservations:
+            database.release_reservation(reservations.pop())
+
+    def first_page(i):
+        next(database.iter_session_history(s.session(i), page_size=10), None)
+
+    return {
+        'db.find_books[title]': (lambda i: database.find_books(s.titles[i % len(s.titles)], "title", 20), cold, False),
+        'db.find_books[word]': (lambda i: database.find_books(s.words[i % len(s.words)], "title", 20), cold, False),
+        'db.find_books[author]': (lambda i: database.find_books(s.authors[i % len(s.authors)], "author", 20), cold, False),
+        'db.find_books[any]': (lambda i: database.find_books(
+            f"{s.words[i % len(s.words)]} {s.authors[i % len(s.authors)].split()[-1]}", "any", 20), cold, False),
+        'db.find_books[cached]': (lambda i: database.find_books(s.titles[0], "title", 20), None, False),
+        'db.resolve_books': (lambda i: database.resolve_books(
+            [s.isbn(i), s.isbn(i + 1), s.titles[(i + 2) % len(s.titles)]]), None, False),
+        'db.get_book': (lambda i: database.get_book(s.isbn(i)), cold, False),
+        'db.get_book[cached]': (lambda i: database.get_book(s.isbn(0)), None, False),
+        'db.get_customer': (lambda i: database.get_customer(s.customer(i)), cold, False),
+        'db.get_inventory_summary': (lambda i: database.get_inventory_summary(), None, False),
+        'db.refresh_inventory_stats': (lambda i: database.refresh_inventory_stats(), None, True),
+        'db.update_stock': (lambda i: database.update_stock(s.isbn(i), 1 if i % 2 == 0 else -1), None, False),
+        'db.update_price': (lambda i: database.update_price(s.isbn(i), s.book(i)['price']), None, False),
+        'db.reserve_stock': (reserve, None, False),
+        'db.release_reservation': (release, None, False),
+        'db.create_order': (lambda i: database.create_order(s.customer(i), s.items(i)), None, False),
+        'db.get_order_status': (lambda i: database.get_order_status(s.order(i)), None, False),
+        'db.sales_report': (lambda i: database.sales_report(**period), None, True),
+        'db.sales_report[author]': (lambda i: database.sales_report(**period, by="author", sort="revenue"), None, True),
+        'db.revenue_by_customer': (lambda i: database.revenue_by_customer(**period), None, True),
+        'db.stock_turnover': (lambda i: database.stock_turnover(**period), None, True),
+        'db.stock_turnover[slowest]': (lambda i: database.stock_turnover(**period, slowest=True), None, True),
+        'db.log_message': (lambda i: database.log_message(s.session(i), "user", f"bench message {i}"), None, False),
+        'db.log_tool_call': (lambda i: database.log_tool_call(
+            s.session(i), "find_books", {'q': 'bench'}, "result", 1.0), None, False),
+        'db.write_log_batch': (lambda i: database.write_log_batch(
+            [(s.session(i), "user", f"bench {k}") for k in range(8)],
+            [(s.session(i), "find_books", {'q': 'bench'}, "result", 1.0)] * 2), None, False),
+        'db.get_session_history': (lambda i: database.get_session_history(s.session(i)), None, False),
+        'db.get_recent_messages': (lambda i: database.get_recent_messages(s.session(i), 20), None, False),
+        'db.iter_session_history': (first_page, None, False),
+        'db.get_all_sessions': (lambda i: database.get_all_sessions(), None, True),
+        'db.list_sessions': (lambda i: database.list_sessions(20), None, False),
+        'db.count_sessions': (lambda i: database.count_sessions(), None, False),
+    }
+
+
+def tool_benchmarks(tools, s: Samples) -> Dict[str, tuple]:
+    cold = tools.db.clear_caches
+    period = s.report()
+    reservations = []
+
+    def reserve(i):
+        reply = tools.reserve_stock(s.items(i, 1))
+        if reply.startswith(" Reservation "):
+            reservations.append(reply.split()[1])
+
+    def release(i):
+        if reservations:
+            tools.release_reservation(reservations.pop())
+
+    return {
+        'tool.find_books': (lambda i: tools.find_books(s.words[i % len(s.words)]), cold, False),
+        'tool.create_order': (lambda i: tools.create_order(s.customer(i), s.items(i)), None, False),
+        'tool.reserve_stock': (reserve, None, False),
+        'tool.release_reservation': (release, None, False),
+        'tool.restock_book': (lambda i: tools.restock_book(s.isbn(i), 1), None, False),
+        'tool.update_price': (lambda i: tools.update_price(s.isbn(i), s.book(i)['price']), None, False),
+        'tool.order_status': (lambda i: tools.order_status(s.order(i)), None, False),
+        'tool.inventory_summary': (lambda i: tools.inventory_summary(), None, False),
+        'tool.reorder_forecast': (lambda i: tools.reorder_forecast(), None, True),
+        'tool.sales_report': (lambda i: tools.sales_report(**period), None, True),
+        'tool.customer_revenue': (lambda i: tools.customer_revenue(**period), None, True),
+        'tool.stock_turnover': (lambda i: tools.stock_turnover(**period), None, True),
+    }
+
+
+def _threads(count: int, work: Callable[[int, List[float]], None]) -> tuple:
+    """Run work(thread_index, samples) on count threads started together"""
+    barrier = threading.Barrier(count + 1)
+    samples = [[] for _ in range(count)]
+
+    def run(t):
+        barrier.wait()
+        work(t, samples[t])
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return [ms for per_thread in samples for ms in per_thread], time.perf_counter() - start
+
+
+def _timed(samples: List[float], fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+def concurrent_benchmarks(database, s: Samples, writers: Iterable[int], ops: int) -> Dict[str, Dict]:
+    """Writer threads against the single group-committing writer"""
+    results = {}
+
+    for count in writers:
+        failures = []
+        before = database.write_stats()
+
+        def orders(t, samples):
+            for k in range(ops):
+                try:
+                    _timed(samples, database.create_order, s.customer(t * ops + k), s.items(t * ops + k))
+                except ValueError as e:
+                    failures.append(str(e))
+
+        samples, seconds = _threads(count, orders)
+        after = database.write_stats()
+        commits = after['commits'] - before['commits']
+        results[f'writers.create_order[{count}]'] = harness.summarize(
+            samples, seconds, kind='throughput', threads=count, failures=len(failures),
+            avg_group=round((after['ops'] - before['ops']) / commits, 2) if commits else 0.0
+        )
+
+        # Every thread on one book: the stock guard's worst case
+        hot = s.isbn(0)
+        samples, seconds = _threads(count, lambda t, samples: [
+            _timed(samples, database.update_stock, hot, 1 if k % 2 == 0 else -1) for k in range(ops)
+        ])
+        results[f'writers.update_stock[hot,{count}]'] = harness.summarize(
+            samples, seconds, kind='throughput', threads=count
+        )
+
+        # Cold reads while the same number of threads write
+        reads, writing = [], [count]
+        lock, done = threading.Lock(), threading.Event()
+
+        def mixed(t, samples):
+            if t >= count:
+                k = 0
+                while not done.is_set():
+                    database.book_cache.pop(s.isbn(k))
+                    _timed(reads, database.get_book, s.isbn(k))
+                    database.search_cache.clear()
+                    _timed(reads, database.find_books, s.words[k % len(s.words)], "title", 20)
+                    k += 1
+                return
+            try:
+                for k in range(ops):
+                    try:
+                        _timed(samples, database.create_order, s.customer(k), s.items(t * ops + k))
+                    except ValueError:
+                        pass
+            finally:
+                with lock:
+                    writing[0] -= 1
+                    if not writing[0]:
+                        done.set()
+
+        samples, seconds = _threads(count * 2, mixed)
+        results[f'mixed.reads_under_writes[{count}]'] = harness.summarize(
+            reads, kind='latency', threads=count, writer_ops_per_sec=round(len(samples) / seconds, 1)
+        )
+
+    return results
+
+
+def _coverage(database, tools, names: Iterable[str]) -> List[str]:
+    """Public Database methods and tools that have no benchmark"""
+    names = set(names)
+    methods = {
+        name for name in dir(database)
+        if not name.startswith('_') and callable(getattr(database, name))
+    } - NOT_BENCHMARKED
+    missing = [f"db.{name}" for name in sorted(methods)
+               if not any(n.startswith(f"db.{name}") for n in names)]
+    missing += [f"tool.{name}" for name in tools.TOOLS
+                if not any(n.startswith(f"tool.{name}") for n in names)]
+    return missing
+
+
+def _dataset(database) -> Dict:
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        counts = {}
+        for table in ('books', 'customers', 'orders', 'order_items', 'messages'):
+            cursor.execute(f"SELECT MAX(rowid) AS n FROM {table}")
+            counts[table] = cursor.fetchone()['n'] or 0
+        return counts
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the database and tool layers")
+    parser.add_argument("db", help="database to benchmark (bench/generate.py makes one)")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a results file from an earlier run")
+    parser.add_argument("--threshold", type=float, default=harness.REGRESSION_THRESHOLD,
+                        help="relative slowdown that counts as a regression (default 0.25)")
+    parser.add_argument("--repeat", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--only", help="comma-separated substrings of benchmark names to run")
+    parser.add_argument("--writers", default="1,4,16", help="thread counts for the concurrent scenarios")
+    parser.add_argument("--writer-ops", type=int, default=100, help="operations per writer thread")
+    parser.add_argument("--no-concurrent", action="store_true")
+    parser.add_argument("--in-place", action="store_true",
+                        help="run against the file itself instead of a copy (it will be modified)")
+    args = parser.parse_args(argv)
+
+    source = Path(args.db)
+    if not source.exists():
+        parser.error(f"{source} not found; create it with bench/generate.py")
+
+    workdir, path = (None, source) if args.in_place else harness.working_database(source)
+
+    # The app's modules bind the database at import time
+    os.environ["LIBRARY_DB"] = str(path)
+    harness.use_server_path()
+    import tools
+    from database import db
+
+    try:
+        db.init_database()
+        samples = Samples(db)
+        for isbn in samples.isbns:
+            db.update_stock(isbn, RESTOCK)
+
+        only = [part.strip() for part in args.only.split(",")] if args.only else None
+        selected = lambda name: not only or any(part in name for part in only)
+
+        benchmarks = {**database_benchmarks(db, samples), **tool_benchmarks(tools, samples)}
+        missing = _coverage(db, tools, benchmarks)
+        if missing:
+            print(f"Not benchmarked: {', '.join(missing)}", file=sys.stderr)
+
+        results = {}
+        for name, (fn, setup, heavy) in benchmarks.items():
+            if not selected(name):
+                continue
+            repeat = max(3, args.repeat // 20) if heavy else args.repeat
+            print(f"  {name}", file=sys.stderr, flush=True)
+            results[name] = harness.measure(fn, repeat, args.warmup, setup)
+
+        if not args.no_concurrent:
+            writers = [int(n) for n in args.writers.split(",") if n.strip()]
+            print("  concurrent scenarios", file=sys.stderr, flush=True)
+            for name, result in concurrent_benchmarks(db, samples, writers, args.writer_ops).items():
+                if selected(name):
+                    results[name] = result
+
+        meta = harness.environment()
+        meta.update({'database': str(source), 'dataset': _dataset(db), 'repeat': args.repeat})
+    finally:
+        db.close()
+        if workdir is not None:
+            workdir.cleanup()
+
+    harness.print_results(results)
+    if args.out:
+        harness.save(args.out, meta, results)
+        print(f"\nResults written to {args.out}")
+
+    if args.baseline and not harness.check_baseline(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
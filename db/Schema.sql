@@ -7,7 +7,8 @@ CREATE TABLE IF NOT EXISTS books (
     author TEXT NOT NULL,
     price REAL NOT NULL,
     stock INTEGER NOT NULL DEFAULT 0,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    book_id INTEGER
 );
 
 CREATE TABLE IF NOT EXISTS customers (
@@ -50,12 +51,154 @@ CREATE TABLE IF NOT EXISTS tool_calls (
     tool_name TEXT NOT NULL,
     args_json TEXT,
     result_json TEXT,
+    duration_ms REAL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE INDEX IF NOT EXISTS idx_books_title ON books(title);
 CREATE INDEX IF NOT EXISTS idx_books_author ON books(author);
 CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders(customer_id);
-CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
-CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id);
-CREATE INDEX IF NOT EXISTS idx_tool_calls_session ON tool_calls(session_id);
\ No newline at end of file
+DROP INDEX IF EXISTS idx_order_items_order;
+CREATE INDEX IF NOT EXISTS idx_order_items_order_cover ON order_items(order_id, isbn, quantity, price_at_purchase);
+DROP INDEX IF EXISTS idx_messages_session;
+CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id, id);
+CREATE INDEX IF NOT EXISTS idx_tool_calls_session ON tool_calls(session_id);
+
+-- Full-text index over book titles and authors, kept in sync by triggers.
+-- It is keyed on book_id, not rowid: books has a TEXT primary key, so its
+-- implicit rowids may be renumbered by VACUUM, while book_id never changes
+CREATE UNIQUE INDEX IF NOT EXISTS idx_books_book_id ON books(book_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title,
+    author,
+    content='books',
+    content_rowid='book_id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+    UPDATE books SET book_id = (SELECT COALESCE(MAX(book_id), 0) + 1 FROM books)
+    WHERE rowid = new.rowid AND book_id IS NULL;
+    INSERT INTO books_fts (rowid, title, author)
+    SELECT book_id, title, author FROM books WHERE rowid = new.rowid;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.book_id, old.title, old.author);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.book_id, old.title, old.author);
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.book_id, new.title, new.author);
+END;
+
+-- Running catalogue totals, maintained by triggers so the summary never scans books
+CREATE TABLE IF NOT EXISTS inventory_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_titles INTEGER NOT NULL DEFAULT 0,
+    total_books INTEGER NOT NULL DEFAULT 0,
+    total_value REAL NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO inventory_stats (id, total_titles, total_books, total_value)
+SELECT 1, COUNT(*), COALESCE(SUM(stock), 0), COALESCE(SUM(stock * price), 0)
+FROM books
+WHERE NOT EXISTS (SELECT 1 FROM inventory_stats);
+
+CREATE TRIGGER IF NOT EXISTS inventory_stats_insert AFTER INSERT ON books BEGIN
+    UPDATE inventory_stats SET
+        total_titles = total_titles + 1,
+        total_books = total_books + new.stock,
+        total_value = total_value + new.stock * new.price
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_stats_delete AFTER DELETE ON books BEGIN
+    UPDATE inventory_stats SET
+        total_titles = total_titles - 1,
+        total_books = total_books - old.stock,
+        total_value = total_value - old.stock * old.price
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_stats_update AFTER UPDATE OF stock, price ON books BEGIN
+    UPDATE inventory_stats SET
+        total_books = total_books + new.stock - old.stock,
+        total_value = total_value + new.stock * new.price - old.stock * old.price
+    WHERE id = 1;
+END;
+
+-- Low-stock lookups read only the rows under the threshold, whatever it is set to
+CREATE INDEX IF NOT EXISTS idx_books_stock ON books(stock);
+
+-- One row per chat session, kept current by a trigger on messages
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_activity TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_sessions_activity ON sessions(last_activity DESC, session_id DESC);
+
+INSERT OR IGNORE INTO sessions (session_id, message_count, last_activity)
+SELECT session_id, COUNT(*), MAX(created_at)
+FROM messages
+WHERE NOT EXISTS (SELECT 1 FROM sessions)
+GROUP BY session_id;
+
+CREATE TRIGGER IF NOT EXISTS sessions_message_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO sessions (session_id, message_count, last_activity)
+    VALUES (new.session_id, 1, new.created_at)
+    ON CONFLICT (session_id) DO UPDATE SET
+        message_count = message_count + 1,
+        last_activity = excluded.last_activity;
+END;
+
+-- Short-lived holds on stock for orders still being put together
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    reservation_id TEXT NOT NULL,
+    isbn TEXT NOT NULL,
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    expires_at REAL NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (reservation_id, isbn),
+    FOREIGN KEY (isbn) REFERENCES books(isbn)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_isbn ON stock_reservations(isbn, expires_at);
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_expiry ON stock_reservations(expires_at);
+
+-- Covering indexes for the date-range sales reports
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at, customer_id, total_amount);
+CREATE INDEX IF NOT EXISTS idx_order_items_isbn ON order_items(isbn, order_id, quantity, price_at_purchase);
+
+-- Units and revenue per book per day, kept current by a trigger on order_items
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day TEXT NOT NULL,
+    isbn TEXT NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    order_lines INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, isbn)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO sales_daily (day, isbn, quantity, revenue, order_lines)
+SELECT date(o.created_at), oi.isbn, SUM(oi.quantity), SUM(oi.quantity * oi.price_at_purchase), COUNT(*)
+FROM order_items oi
+JOIN orders o ON o.id = oi.order_id
+WHERE NOT EXISTS (SELECT 1 FROM sales_daily)
+GROUP BY date(o.created_at), oi.isbn;
+
+CREATE TRIGGER IF NOT EXISTS sales_daily_insert AFTER INSERT ON order_items BEGIN
+    INSERT INTO sales_daily (day, isbn, quantity, revenue, order_lines)
+    VALUES (
+        (SELECT date(created_at) FROM orders WHERE id = new.order_id),
+        new.isbn, new.quantity, new.quantity * new.price_at_purchase, 1
+    )
+    ON CONFLICT (day, isbn) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        order_lines = order_lines + 1;
+END;
@@ -6,15 +6,26 @@ from dotenv import load_dotenv
 sys.path.insert(0, str(Path(__file__).parent / "server"))
 from agent_groq import LibraryAgent
 from database import db
+from log_writer import LOG_WRITER
+from tracing import TRACER
 
 load_dotenv()
 
+SESSIONS_PAGE_SIZE = 20
+HISTORY_PAGE_SIZE = 10
+
 class TerminalUI:
     """Simple terminal interface"""
     
-    def __init__(self):
+    def __init__(self, read=input, agent_factory=LibraryAgent):
+        # read(prompt) supplies each line of input; agent_factory(session_id=...) builds agents
+        self.read = read
+        self.agent_factory = agent_factory
         self.agent = None
+        self.agents = {}
         self.session_id = None
+        self.listed_sessions = []
+        self.sessions_cursor = None
     
     def clear_screen(self):
         """Clear terminal"""
@@ -30,48 +41,64 @@ class TerminalUI:
         """Show commands"""
         print("\n Commands:")
         print("  • Type your question")
-        print("  • 'sessions' - List all sessions")
+        print("  • 'sessions' - List recent sessions ('more' for older)")
         print("  • 'history' - Show current session history")
-        print("  • 'switch <number>' - Change session")
+        print("  • 'stats' - Where recent turns spent their time")
+        print("  • 'switch <number>' - Change session (number from the last listing)")
         print("  • 'new' - New session")
         print("  • 'clear' - Clear screen")
         print("  • 'quit' - Exit\n")
     
-    def show_sessions(self):
-        sessions = db.get_all_sessions()
-        
-        if not sessions:
-            print("\n  No saved sessions\n")
-            return sessions
-        
-        # Get message counts
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        print("\n Available Sessions:")
-        for i, session in enumerate(sessions, 1):
-            # Count messages for this session
-            cursor.execute(
-                "SELECT COUNT(*) as count FROM messages WHERE session_id = ?",
-                (session,)
-            )
-            msg_count = cursor.fetchone()['count']
-            
-            marker = "✓" if session == self.session_id else " "
-            print(f"  {marker} {i}. {session}  {msg_count} msg")
+    def show_sessions(self, more=False):
+        """List sessions, most recent first, one page at a time"""
+        LOG_WRITER.flush()
+        
+        if not more:
+            self.listed_sessions = []
+            self.sessions_cursor = None
+        elif self.sessions_cursor is None:
+            print("\n  No more sessions\n")
+            return self.listed_sessions
+        
+        page = db.list_sessions(limit=SESSIONS_PAGE_SIZE, after=self.sessions_cursor)
+        
+        if not page:
+            if not self.listed_sessions:
+                print("\n  No saved sessions\n")
+            else:
+                print("\n  No more sessions\n")
+            self.sessions_cursor = None
+            return self.listed_sessions
+        
+        if not more:
+            print("\n Available Sessions:")
+        
+        start = len(self.listed_sessions) + 1
+        for i, session in enumerate(page, start):
+            marker = "✓" if session['session_id'] == self.session_id else " "
+            print(f"  {marker} {i}. {session['session_id']}  {session['message_count']} msg  "
+                  f"(last: {session['last_activity']})")
+        
+        self.listed_sessions += [session['session_id'] for session in page]
+        
+        if len(page) == SESSIONS_PAGE_SIZE:
+            last = page[-1]
+            self.sessions_cursor = (last['last_activity'], last['session_id'])
+            print("  ... type 'more' for older sessions")
+        else:
+            self.sessions_cursor = None
         
-        conn.close()
         print()
-        return sessions
+        return self.listed_sessions
     
     def select_session(self):
-        sessions = db.get_all_sessions()
+        total = db.count_sessions()
         
-        if sessions:
-            print(f"\n✓ Found {len(sessions)} session(s)")
-            self.show_sessions()
+        if total:
+            print(f"\n✓ Found {total} session(s)")
+            sessions = self.show_sessions()
             
-            choice = input("Select session number (or Enter for new): ").strip()
+            choice = self.read("Select session number (or Enter for new): ").strip()
             
             if choice.isdigit() and 1 <= int(choice) <= len(sessions):
                 return sessions[int(choice) - 1]
@@ -79,13 +106,50 @@ class TerminalUI:
         # Create new session
         return f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
     
+    def show_history(self):
+        """Page through the current session from the newest messages back"""
+        LOG_WRITER.flush()
+        
+        shown = 0
+        for page in db.iter_session_history(self.session_id, page_size=HISTORY_PAGE_SIZE):
+            if not shown:
+                print("\n Session History (newest first):")
+            print("=" * 60)
+            for msg in page:
+                role = " You" if msg['role'] == 'user' else " Agent"
+                print(f"\n{role}:")
+                print(msg['content'])
+            print("=" * 60)
+            shown += len(page)
+            
+            if len(page) < HISTORY_PAGE_SIZE:
+                break
+            if self.read(" Enter for older messages, 'q' to stop: ").strip().lower() == 'q':
+                break
+        
+        if not shown:
+            print("\n No messages in this session yet.\n")
+        else:
+            print()
+    
+    def open_session(self, session_id, load=True):
+        """Make session_id current, reusing its agent if it was opened before"""
+        self.session_id = session_id
+        self.agent = self.agents.get(session_id)
+        if self.agent is None:
+            # Agents are cheap: the LLM client and prompt live in the shared runtime
+            self.agent = self.agent_factory(session_id=session_id)
+            if load:
+                self.agent.load_history()
+            self.agents[session_id] = self.agent
+        return self.agent
+    
     def init_agent(self):
         """Initialize agent"""
-        self.session_id = self.select_session()
-        print(f"\n Loading: {self.session_id}")
+        session_id = self.select_session()
+        print(f"\n Loading: {session_id}")
         
-        self.agent = LibraryAgent(session_id=self.session_id)
-        self.agent.load_history()
+        self.open_session(session_id)
         
         # Show previous messages if any
         history = self.agent.get_history()
@@ -103,75 +167,77 @@ class TerminalUI:
         
         print("✓ Ready!\n")
     
+    def handle_command(self, user_input):
+        """Handle one line of input: a terminal command or a message for the agent.
+        
+        Returns False when the user asked to quit.
+        """
+        cmd = user_input.lower()
+        
+        # Exit
+        if cmd in ['quit', 'exit', 'q']:
+            LOG_WRITER.close()
+            print("\n Goodbye!\n")
+            return False
+        
+        # Clear
+        elif cmd == 'clear':
+            self.clear_screen()
+            self.print_header()
+            self.print_menu()
+        
+        # Sessions
+        elif cmd == 'sessions':
+            self.show_sessions()
+        
+        elif cmd == 'more':
+            self.show_sessions(more=True)
+        
+        # History
+        elif cmd == 'history':
+            self.show_history()
+        
+        # Timing breakdown of traced turns
+        elif cmd == 'stats':
+            print("\n" + TRACER.format_stats() + "\n")
+        
+        # Switch
+        elif cmd.startswith('switch '):
+            num = cmd.split()[1]
+            if num.isdigit():
+                # Numbers refer to the last 'sessions' listing
+                sessions = self.listed_sessions or self.show_sessions()
+                idx = int(num) - 1
+                if 0 <= idx < len(sessions):
+                    self.open_session(sessions[idx])
+                    print(f"\n✓ Switched to: {self.session_id}\n")
+        
+        # New session
+        elif cmd == 'new':
+            self.open_session(f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}", load=False)
+            print(f"\n✓ New session: {self.session_id}\n")
+        
+        # Send to agent
+        else:
+            print("\n Agent: ", end="", flush=True)
+            for chunk in self.agent.stream(user_input):
+                print(chunk, end="", flush=True)
+            print("\n")
+        
+        return True
+    
     def chat_loop(self):
         while True:
             try:
                 # Get input
-                user_input = input(f" You: ").strip()
+                user_input = self.read(f" You: ").strip()
                 
                 if not user_input:
                     continue
                 
-                # Handle commands
-                cmd = user_input.lower()
-                
-                # Exit
-                if cmd in ['quit', 'exit', 'q']:
-                    print("\n Goodbye!\n")
+                if not self.handle_command(user_input):
                     break
                 
-                # Clear
-                elif cmd == 'clear':
-                    self.clear_screen()
-                    self.print_header()
-                    self.print_menu()
-                    continue
-                
-                # Sessions
-                elif cmd == 'sessions':
-                    self.show_sessions()
-                    continue
-                
-                # History
-                elif cmd == 'history':
-                    history = self.agent.get_history()
-                    if not history:
-                        print("\n No messages in this session yet.\n")
-                    else:
-                        print(f"\n Session History ({len(history)} messages):")
-                        print("=" * 60)
-                        for msg in history:
-                            role = " You" if msg['role'] == 'user' else " Agent"
-                            print(f"\n{role}:")
-                            print(msg['content'])
-                        print("=" * 60 + "\n")
-                    continue
-                
-                # Switch
-                elif cmd.startswith('switch '):
-                    num = cmd.split()[1]
-                    if num.isdigit():
-                        sessions = db.get_all_sessions()
-                        idx = int(num) - 1
-                        if 0 <= idx < len(sessions):
-                            self.session_id = sessions[idx]
-                            self.agent = LibraryAgent(session_id=self.session_id)
-                            self.agent.load_history()
-                            print(f"\n✓ Switched to: {self.session_id}\n")
-                    continue
-                
-                # New session
-                elif cmd == 'new':
-                    self.session_id = f"session-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-                    self.agent = LibraryAgent(session_id=self.session_id)
-                    print(f"\n✓ New session: {self.session_id}\n")
-                    continue
-                
-                # Send to agent
-                print("\n Agent: ", end="", flush=True)
-                response = self.agent.chat(user_input)
-                print(response + "\n")
-                
             except KeyboardInterrupt:
                 print("\n\nInterrupted. Goodbye!\n")
                 break
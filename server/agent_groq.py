@@ -5,112 +5,463 @@ Library Desk Agent - Simple & Clean
 import os
 import re
 import json
-from pathlib import Path
-from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from tools import TOOLS
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from tool_runner import ToolBatch, TOOL_EXECUTOR
+from plan_cache import PLAN_CACHE
+from router import ROUTER
+from log_writer import LOG_WRITER
+from context import ConversationContext
+from runtime import AgentRuntime, RUNTIME
+from tracing import TRACER, in_context, record_usage
 from database import db
 
+# Blocking DB/tool work for achat runs here so the event loop stays free
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AGENT_DB_WORKERS", "8")),
+    thread_name_prefix="agent-db"
+)
+
+# Messages read back from the database when a session is resumed; the
+# context budget decides how many stay verbatim
+HISTORY_LOAD_LIMIT = int(os.getenv("AGENT_HISTORY_LOAD", "20"))
+
+# Model round trips per turn; above 1, tool results are fed back so the
+# model can chain calls (e.g. look up an ISBN, then order it)
+MAX_TOOL_ROUNDS = int(os.getenv("AGENT_TOOL_ROUNDS", "1"))
+
+
+def _marker_overlap(text):
+    """Length of the longest suffix of text that could begin a TOOL: marker"""
+    tail = text[-4:].upper()
+    for size in range(len(tail), 0, -1):
+        if "TOOL:".startswith(tail[-size:]):
+            return size
+    return 0
+
+
 class LibraryAgent:
 
-    def __init__(self, session_id="default"):
+    def __init__(self, session_id="default", llm=None, max_tool_rounds=MAX_TOOL_ROUNDS,
+                 context=None, runtime=None):
         self.session_id = session_id
-        self.history = []
-        self.prompt = self._load_prompt()
-
-        self.llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
-            temperature=0,
-            groq_api_key=os.getenv("GROQ_API_KEY"),
-            max_tokens=100
-        )
+        self.context = context or ConversationContext()
+        self.last_tool_runs = []
+        self.max_tool_rounds = max(1, max_tool_rounds)
+
+        # Sessions share the process-wide client and prompt; passing an llm
+        # (e.g. a fake model in tests) gives this agent a runtime of its own
+        self.runtime = runtime or (AgentRuntime(llm=llm) if llm is not None else RUNTIME)
+
+    @property
+    def llm(self):
+        return self.runtime.llm
+
+    @property
+    def llm_tools(self):
+        return self.runtime.llm_tools
+
+    @property
+    def prompt(self):
+        return self.runtime.prompt
 
-    def _load_prompt(self):
-        """Load system prompt from file"""
-        prompt_file = Path(__file__).parent.parent / "prompts" / "system_prompt.md"
+    @property
+    def history(self):
+        return self.context.messages
 
-        if prompt_file.exists():
-            return prompt_file.read_text(encoding='utf-8')
+    def _build_messages(self, msg):
+        with TRACER.span("agent.prompt") as span:
+            messages = self.context.build(self.prompt, msg)
+            if span is not None:
+                span.set(messages=len(messages))
+            return messages
 
-        return "You are a Library Agent. Use tools when needed."
+    def _local_plan(self, msg):
+        """Tool plan from the rule router or the plan cache, if either has one"""
+        with TRACER.span("agent.route") as span:
+            plan = ROUTER.route(msg)
+            if plan is None:
+                plan = PLAN_CACHE.lookup(msg)
+            if span is not None:
+                span.set(hit=plan is not None)
+            return plan
+
+    def _remember(self, msg, response):
+        with TRACER.span("agent.context"):
+            self.context.add_turn(msg, response)
 
     def chat(self, msg):
         try:
-            db.log_message(self.session_id, "user", msg)
+            with TRACER.trace("agent.chat", session=self.session_id):
+                LOG_WRITER.log_message(self.session_id, "user", msg)
+
+                # Simple commands and repeated questions skip the model entirely
+                plan = self._local_plan(msg)
+                if plan is not None:
+                    response = "\n\n".join(self._run_calls(plan))
+                else:
+                    response = self._model_reply(msg)
+
+                self._remember(msg, response)
+
+                LOG_WRITER.log_message(self.session_id, "assistant", response)
+                return response
+
+        except Exception as e:
+            return f"Error: {e}"
+
+    async def achat(self, msg):
+        """Async chat: awaits the LLM and runs tools off the event loop.
+
+        Turns for one agent must not overlap (history is per agent); run
+        one agent per session to serve many sessions concurrently.
+        """
+        try:
+            with TRACER.trace("agent.achat", session=self.session_id):
+                LOG_WRITER.log_message(self.session_id, "user", msg)
+                loop = asyncio.get_running_loop()
 
-            ai = self.llm.invoke([
-                SystemMessage(content=self.prompt),
-                *self.history[-6:],
-                HumanMessage(content=msg)
-            ]).content.strip()
+                plan = self._local_plan(msg)
+                if plan is not None:
+                    outputs = await loop.run_in_executor(DB_EXECUTOR, in_context(self._run_calls), plan)
+                    response = "\n\n".join(outputs)
+                else:
+                    messages = self._build_messages(msg)
 
-            response = self._exec_tool(ai) if "TOOL:" in ai.upper() else ai
+                    ai_msg = await self._ainvoke(messages)
 
-            self.history += [HumanMessage(content=msg), AIMessage(content=response)]
-            if len(self.history) > 10:
-                self.history = self.history[-10:]
+                    calls, ids = self._model_calls(ai_msg)
+                    if not calls:
+                        response = ai_msg.content.strip()
+                    else:
+                        outputs = await loop.run_in_executor(DB_EXECUTOR, in_context(self._run_calls), calls)
+                        follow = await self._afollow_up(messages, ai_msg, ids, outputs)
+                        if not follow:
+                            PLAN_CACHE.store(msg, calls)
+                        response = "\n\n".join(outputs + follow)
 
-            db.log_message(self.session_id, "assistant", response)
-            return response
+                self._remember(msg, response)
+
+                LOG_WRITER.log_message(self.session_id, "assistant", response)
+                return response
 
         except Exception as e:
             return f"Error: {e}"
 
-    def _exec_tool(self, ai_text):
-        """Execute ALL tools found in AI response"""
+    def stream(self, msg):
+        """Yield the reply as it is produced (see _stream_model)"""
+        # The turn's trace is current only while the agent runs, not in the caller between chunks
+        return TRACER.trace_steps("agent.stream", self._stream_turn(msg), session=self.session_id)
+
+    def _stream_turn(self, msg):
         try:
-            # Find ALL matches (not just first)
-            matches = list(re.finditer(r'TOOL:\s*(\w+)\((.*?)\)', ai_text, re.DOTALL))
-            
-            if not matches:
-                return ai_text
-            
-            results = []
-            
-            for match in matches:
-                tool_name = match.group(1)
-                args_str = match.group(2).strip()
-                
-                if tool_name not in TOOLS:
-                    results.append(f"Unknown tool: {tool_name}")
+            LOG_WRITER.log_message(self.session_id, "user", msg)
+
+            plan = self._local_plan(msg)
+            if plan is not None:
+                response = "\n\n".join(self._run_calls(plan))
+                yield response
+            else:
+                response = yield from self._stream_model(msg)
+
+            self._remember(msg, response)
+
+            LOG_WRITER.log_message(self.session_id, "assistant", response)
+
+        except Exception as e:
+            yield f"Error: {e}"
+
+    def _stream_model(self, msg):
+        """Stream the model's reply; returns the full response when done.
+
+        Plain answers are echoed token by token. Tool calls - native or
+        TOOL: text - start as soon as each one is complete, and results are
+        yielded in order while the model is still generating.
+        """
+        messages = self._build_messages(msg)
+        gathered = None
+        text = ""
+        shown = 0
+        tool_mode = False
+        batch = ToolBatch()
+        calls = []
+        emitted = 0
+        outputs = []
+
+        # Not made current: tools started mid-stream belong to the turn, not the model call
+        llm_span = TRACER.open_span("llm", "llm", messages=len(messages), stream=True)
+        start = time.perf_counter()
+        try:
+            for chunk in self.llm_tools.stream(messages):
+                if gathered is None and llm_span is not None:
+                    llm_span.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 3))
+                gathered = chunk if gathered is None else gathered + chunk
+                text += chunk.content if isinstance(chunk.content, str) else ""
+
+                if gathered.tool_call_chunks:
+                    # A native call is complete once the next one starts
+                    tool_mode = True
+                    complete = len({tc['index'] for tc in gathered.tool_call_chunks}) - 1
+                    ready = [(name, args) for name, args, _ in self._native_calls(gathered)[:complete]]
+                elif "TOOL:" in text.upper():
+                    tool_mode = True
+                    ready = self._parse_tool_calls(text)
+                else:
+                    # Hold back a tail that might be the start of "TOOL:"
+                    safe = len(text) - _marker_overlap(text)
+                    if safe > shown:
+                        yield text[shown:safe]
+                        shown = safe
                     continue
-                
-                tool_func = TOOLS[tool_name]['function']
-                
-                args = {}
-                if args_str:
-                    for m in re.finditer(r'(\w+)=(?:"([^"]*)"|\'([^\']*)\'|(\[[^\]]*\])|([^,)]+))', args_str):
-                        k = m.group(1)
-                        v = (m.group(2) or m.group(3) or m.group(4) or m.group(5)).strip()
-                        
-                        if k == "items":
-                            try:
-                                args[k] = json.loads(v)
-                            except:
-                                args[k] = v
-                        elif v.isdigit():
-                            args[k] = int(v)
-                        elif '.' in v and v.replace('.','').isdigit():
-                            args[k] = float(v)
-                        else:
+
+                for tool_name, args in ready[len(calls):]:
+                    batch.submit(tool_name, args)
+                    calls.append((tool_name, args))
+
+                while emitted < len(batch.runs) and batch.is_done(batch.runs[emitted]):
+                    outputs.append(batch.runs[emitted]['result'])
+                    yield ("\n\n" if emitted else "") + outputs[-1]
+                    emitted += 1
+        except Exception as e:
+            if llm_span is not None:
+                llm_span.set(error=type(e).__name__)
+            raise
+        finally:
+            # Also when the model fails or the caller stops reading mid-stream
+            if llm_span is not None:
+                record_usage(llm_span, gathered)
+                llm_span.finish()
+        ROUTER.record_llm_call(time.perf_counter() - start)
+
+        ids = []
+        native_calls = self._native_calls(gathered) if gathered is not None else []
+        if native_calls:
+            final = [(name, args) for name, args, _ in native_calls]
+            ids = [call_id for _, _, call_id in native_calls]
+        elif tool_mode:
+            final = self._parse_tool_calls(text)
+        else:
+            final = []
+
+        for tool_name, args in final[len(calls):]:
+            batch.submit(tool_name, args)
+            calls.append((tool_name, args))
+
+        for run in batch.runs[emitted:]:
+            if run['future'] is not None:
+                run['future'].result()
+            outputs.append(run['result'])
+            yield ("\n\n" if emitted else "") + outputs[-1]
+            emitted += 1
+
+        if not outputs:
+            if len(text) > shown:
+                yield text[shown:]
+            return text.strip()
+
+        self._record_runs(batch)
+        PLAN_CACHE.invalidate_writes(calls)
+
+        ai_msg = AIMessage(
+            content=text, tool_calls=gathered.tool_calls, invalid_tool_calls=gathered.invalid_tool_calls
+        ) if ids else None
+        follow = self._follow_up(messages, ai_msg, ids, outputs)
+        for part in follow:
+            yield "\n\n" + part
+
+        if not follow:
+            PLAN_CACHE.store(msg, calls)
+        return "\n\n".join(outputs + follow)
+
+    def _parse_tool_calls(self, ai_text):
+        """Extract (tool_name, args) pairs for every TOOL: call in the text"""
+        calls = []
+        
+        for match in re.finditer(r'TOOL:\s*(\w+)\((.*?)\)', ai_text, re.DOTALL):
+            tool_name = match.group(1)
+            args_str = match.group(2).strip()
+            
+            args = {}
+            if args_str:
+                for m in re.finditer(r'(\w+)=(?:"([^"]*)"|\'([^\']*)\'|(\[[^\]]*\])|([^,)]+))', args_str):
+                    k = m.group(1)
+                    v = (m.group(2) or m.group(3) or m.group(4) or m.group(5)).strip()
+                    
+                    if k == "items":
+                        try:
+                            args[k] = json.loads(v)
+                        except:
                             args[k] = v
-                
-                # Execute tool
-                result = tool_func(**args) if args else tool_func()
-                results.append(result)
+                    elif v.isdigit():
+                        args[k] = int(v)
+                    elif '.' in v and v.replace('.','').isdigit():
+                        args[k] = float(v)
+                    else:
+                        args[k] = v
             
-            # Combine all results
-            return "\n\n".join(results)
+            calls.append((tool_name, args))
         
-        except Exception as e:
-            return f"Error: {e}"
+        return calls
+
+    def _invoke(self, messages):
+        with TRACER.span("llm", "llm", messages=len(messages)) as span:
+            start = time.perf_counter()
+            ai_msg = self.llm_tools.invoke(messages)
+            ROUTER.record_llm_call(time.perf_counter() - start)
+            record_usage(span, ai_msg)
+        return ai_msg
+
+    async def _ainvoke(self, messages):
+        with TRACER.span("llm", "llm", messages=len(messages)) as span:
+            start = time.perf_counter()
+            ai_msg = await self.llm_tools.ainvoke(messages)
+            ROUTER.record_llm_call(time.perf_counter() - start)
+            record_usage(span, ai_msg)
+        return ai_msg
+
+    def _model_calls(self, ai_msg):
+        """Tool calls in a model reply: native tool_calls, else TOOL: lines.
+
+        Returns (calls, ids); ids are None for calls parsed from text.
+        """
+        with TRACER.span("agent.parse") as span:
+            native_calls = self._native_calls(ai_msg)
+            native = bool(native_calls)
+            if native:
+                calls = [(name, args) for name, args, _ in native_calls]
+                ids = [call_id for _, _, call_id in native_calls]
+            else:
+                text = ai_msg.content if isinstance(ai_msg.content, str) else ""
+                calls = self._parse_tool_calls(text) if "TOOL:" in text.upper() else []
+                ids = [None] * len(calls)
+            if span is not None:
+                span.set(calls=len(calls), native=native)
+            return calls, ids
+
+    @staticmethod
+    def _native_calls(ai_msg):
+        """(name, args, id) for each native tool call, in order.
+
+        A call whose arguments failed to parse keeps its raw argument text
+        in place of args, so it runs as an error result the model can see.
+        """
+        calls = {tc['id']: (tc['name'], tc['args'], tc['id'])
+                 for tc in getattr(ai_msg, 'tool_calls', None) or []}
+        for tc in getattr(ai_msg, 'invalid_tool_calls', None) or []:
+            calls[tc.get('id')] = (tc.get('name') or "unknown", tc.get('args') or "", tc.get('id'))
+
+        # Streamed replies know the order the calls were generated in
+        chunks = sorted(getattr(ai_msg, 'tool_call_chunks', None) or [], key=lambda tc: tc['index'] or 0)
+        order = [tc['id'] for tc in chunks if tc['id'] in calls]
+        order += [call_id for call_id in calls if call_id not in order]
+        return [calls[call_id] for call_id in order]
+
+    def _model_reply(self, msg):
+        """Ask the model and run whatever tools it calls"""
+        messages = self._build_messages(msg)
+        ai_msg = self._invoke(messages)
+
+        calls, ids = self._model_calls(ai_msg)
+        if not calls:
+            return ai_msg.content.strip()
+
+        outputs = self._run_calls(calls)
+        follow = self._follow_up(messages, ai_msg, ids, outputs)
+
+        # Only single-round plans can be replayed without the model
+        if not follow:
+            PLAN_CACHE.store(msg, calls)
+        return "\n\n".join(outputs + follow)
+
+    def _follow_up(self, messages, ai_msg, ids, outputs):
+        """Feed tool results back to the model for up to max_tool_rounds - 1 more rounds"""
+        extra = []
+        rounds_left = self.max_tool_rounds - 1
+
+        while rounds_left > 0 and ids and None not in ids:
+            messages = self._with_results(messages, ai_msg, ids, outputs)
+            ai_msg = self._invoke(messages)
+
+            calls, ids = self._model_calls(ai_msg)
+            if not calls:
+                text = ai_msg.content.strip()
+                if text:
+                    extra.append(text)
+                break
+
+            outputs = self._run_calls(calls)
+            extra += outputs
+            rounds_left -= 1
+
+        return extra
+
+    async def _afollow_up(self, messages, ai_msg, ids, outputs):
+        """_follow_up for achat: awaits the model, only the tools run on DB_EXECUTOR"""
+        loop = asyncio.get_running_loop()
+        extra = []
+        rounds_left = self.max_tool_rounds - 1
+
+        while rounds_left > 0 and ids and None not in ids:
+            messages = self._with_results(messages, ai_msg, ids, outputs)
+            ai_msg = await self._ainvoke(messages)
+
+            calls, ids = self._model_calls(ai_msg)
+            if not calls:
+                text = ai_msg.content.strip()
+                if text:
+                    extra.append(text)
+                break
+
+            outputs = await loop.run_in_executor(DB_EXECUTOR, in_context(self._run_calls), calls)
+            extra += outputs
+            rounds_left -= 1
+
+        return extra
+
+    @staticmethod
+    def _with_results(messages, ai_msg, ids, outputs):
+        """The conversation so far plus the model's tool calls and their results"""
+        return messages + [ai_msg] + [
+            ToolMessage(content=output, tool_call_id=call_id)
+            for output, call_id in zip(outputs, ids)
+        ]
+
+    def _run_calls(self, calls):
+        """Run tool calls; independent ones run concurrently. Returns outputs in order"""
+        with TRACER.span("agent.tools", calls=len(calls)):
+            # A lone call runs inline
+            batch = ToolBatch(executor=TOOL_EXECUTOR if len(calls) > 1 else None)
+            for tool_name, args in calls:
+                batch.submit(tool_name, args)
+            
+            results = batch.results()
+        self._record_runs(batch)
+        PLAN_CACHE.invalidate_writes(calls)
+        
+        return results
+
+    def _record_runs(self, batch):
+        """Keep timings for the last batch and queue an audit row per call"""
+        self.last_tool_runs = batch.timings()
+        for run in batch.runs:
+            LOG_WRITER.log_tool_call(
+                self.session_id, run['tool'], run['args'], run['result'], round(run['ms'], 2)
+            )
+
     def load_history(self):
-        msgs = db.get_session_history(self.session_id)[-10:]
-        self.history = [
+        LOG_WRITER.flush()
+        msgs = db.get_recent_messages(self.session_id, HISTORY_LOAD_LIMIT)
+        self.context.reset(
             HumanMessage(content=m['content']) if m['role'] == 'user' 
             else AIMessage(content=m['content'])
             for m in msgs
-        ]
+        )
+
+    async def aload_history(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(DB_EXECUTOR, self.load_history)
 
     def get_history(self):
         return [
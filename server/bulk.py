@@ -0,0 +1,358 @@
+"""
+Streaming bulk import/export of the books catalogue (CSV or JSONL)
+
+Import columns: isbn (required), title, author, price, stock, stock_delta.
+A row for a new ISBN needs title, author and price. For an existing book,
+any column left empty keeps its current value; `stock` sets the level and
+`stock_delta` adds to (or with a negative number, removes from) it.
+
+    python server/bulk.py import delivery.csv --errors rejected.csv
+    python server/bulk.py export inventory.jsonl
+"""
+
+import os
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+from database import db
+
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "5000"))
+# Invalid rows kept in the returned report; the on_error callback sees all of them
+MAX_REPORTED_ERRORS = 1000
+
+FIELDS = ("isbn", "title", "author", "price", "stock")
+
+# Above this many new books per chunk, the search index is filled with one
+# set-based insert instead of the per-row trigger (about twice as fast)
+DEFER_INDEX_ROWS = 500
+
+
+def _format(path, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    suffix = Path(str(path)).suffix.lower()
+    return "jsonl" if suffix in (".jsonl", ".ndjson", ".json") else "csv"
+
+
+def iter_rows(path, fmt: Optional[str] = None) -> Iterator[Tuple[int, object]]:
+    """Yield (line number, raw row) from a CSV or JSONL file, one row at a time"""
+    fmt = _format(path, fmt)
+
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, ValueError(f"invalid JSON: {e}")
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _number(value, kind, name, minimum=None):
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        number = kind(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a finite number, got {value!r}")
+    if minimum is not None and number < minimum:
+        raise ValueError(f"{name} must be >= {minimum}, got {value}")
+    return number
+
+
+def parse_row(row) -> Dict:
+    """Validate one raw row into {isbn, title, author, price, stock, stock_delta}"""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+
+    isbn = _text(row.get("isbn"))
+    if not isbn:
+        raise ValueError("isbn is required")
+
+    return {
+        "isbn": isbn,
+        "title": _text(row.get("title")),
+        "author": _text(row.get("author")),
+        "price": _number(row.get("price"), float, "price", 0),
+        "stock": _number(row.get("stock"), int, "stock", 0),
+        "stock_delta": _number(row.get("stock_delta"), int, "stock_delta")
+    }
+
+
+def _apply_chunk(cursor, chunk):
+    """Merge a chunk of parsed rows into books with a few executemany calls.
+
+    Rows are applied in file order against the current state (read once per
+    chunk), so repeated ISBNs and stock deltas net out before anything is
+    written. Only changed columns are written: title/author changes touch the
+    search index, price/stock changes the inventory totals.
+    """
+    isbns = list(dict.fromkeys(line_row[1]["isbn"] for line_row in chunk))
+    cursor.execute("""
+        SELECT isbn, title, author, price, stock
+        FROM books
+        WHERE isbn IN (SELECT value FROM json_each(?))
+    """, (json.dumps(isbns),))
+    before = {row["isbn"]: dict(row) for row in cursor.fetchall()}
+    after = {isbn: dict(book) for isbn, book in before.items()}
+
+    errors = []
+    for line_no, row in chunk:
+        book = after.get(row["isbn"])
+        if book is None:
+            missing = [name for name in ("title", "author", "price") if row[name] is None]
+            if missing:
+                errors.append((line_no, row["isbn"], f"new book needs {', '.join(missing)}"))
+                continue
+            book = {"isbn": row["isbn"], "title": None, "author": None, "price": None, "stock": 0}
+
+        stock = book["stock"] if row["stock"] is None else row["stock"]
+        if row["stock_delta"] is not None:
+            stock += row["stock_delta"]
+        if stock < 0:
+            errors.append((line_no, row["isbn"], f"stock would go negative ({stock})"))
+            continue
+
+        for name in ("title", "author", "price"):
+            if row[name] is not None:
+                book[name] = row[name]
+        book["stock"] = stock
+        after[row["isbn"]] = book
+
+    inserts, renames, levels = [], [], []
+    for isbn, book in after.items():
+        old = before.get(isbn)
+        if old is None:
+            inserts.append(tuple(book[name] for name in FIELDS))
+            continue
+        if (book["title"], book["author"]) != (old["title"], old["author"]):
+            renames.append((book["title"], book["author"], isbn))
+        if (book["price"], book["stock"]) != (old["price"], old["stock"]):
+            levels.append((book["price"], book["stock"], isbn))
+
+    if len(inserts) >= DEFER_INDEX_ROWS:
+        _insert_deferring_index(cursor, inserts)
+    elif inserts:
+        cursor.executemany(
+            "INSERT INTO books (isbn, title, author, price, stock) VALUES (?, ?, ?, ?, ?)",
+            inserts
+        )
+    if renames:
+        cursor.executemany("UPDATE books SET title = ?, author = ? WHERE isbn = ?", renames)
+    if levels:
+        cursor.executemany("UPDATE books SET price = ?, stock = ? WHERE isbn = ?", levels)
+
+    return {
+        "inserted": len(inserts),
+        "updated": len({isbn for _, _, isbn in renames} | {isbn for _, _, isbn in levels}),
+        "rejected": errors
+    }
+
+
+def _insert_deferring_index(cursor, inserts):
+    """Insert new books with the FTS insert trigger suspended for this transaction.
+
+    The trigger is dropped and re-created from its own stored definition
+    inside the same transaction, so nothing outside it sees the change and a
+    rollback restores it.
+    """
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'books_fts_insert'")
+    row = cursor.fetchone()
+    if row is not None:
+        cursor.execute("DROP TRIGGER books_fts_insert")
+
+    cursor.executemany(
+        "INSERT INTO books (isbn, title, author, price, stock) VALUES (?, ?, ?, ?, ?)",
+        inserts
+    )
+
+    if row is not None:
+        # What the trigger does per row: number the new books, then index them
+        isbns = json.dumps([book[0] for book in inserts])
+        cursor.execute("""
+            UPDATE books SET book_id = fresh.book_id
+            FROM (
+                SELECT isbn,
+                       (SELECT COALESCE(MAX(book_id), 0) FROM books)
+                       + ROW_NUMBER() OVER (ORDER BY rowid) AS book_id
+                FROM books
+                WHERE isbn IN (SELECT value FROM json_each(?)) AND book_id IS NULL
+            ) AS fresh
+            WHERE books.isbn = fresh.isbn
+        """, (isbns,))
+        cursor.execute("""
+            INSERT INTO books_fts (rowid, title, author)
+            SELECT book_id, title, author
+            FROM books
+            WHERE isbn IN (SELECT value FROM json_each(?))
+        """, (isbns,))
+        cursor.execute(row["sql"])
+
+
+def import_books(path, fmt: Optional[str] = None, chunk_size: int = BULK_CHUNK_SIZE,
+                 database=None, progress: Optional[Callable[[Dict], None]] = None,
+                 on_error: Optional[Callable[[int, Optional[str], str], None]] = None) -> Dict:
+    """Stream a CSV/JSONL file into books, one transaction per chunk.
+
+    progress(report) is called after every chunk; on_error(line, isbn,
+    message) for every rejected row. Returns the final report.
+    """
+    database = database or db
+    chunk_size = max(1, chunk_size)
+    report = {"rows": 0, "inserted": 0, "updated": 0, "errors": 0,
+              "error_rows": [], "seconds": 0.0, "rows_per_sec": 0.0}
+    start = time.perf_counter()
+
+    def reject(line_no, isbn, message):
+        report["errors"] += 1
+        if len(report["error_rows"]) < MAX_REPORTED_ERRORS:
+            report["error_rows"].append({"line": line_no, "isbn": isbn, "error": message})
+        if on_error:
+            on_error(line_no, isbn, message)
+
+    chunk = []
+    for line_no, raw in iter_rows(path, fmt):
+        report["rows"] += 1
+        try:
+            chunk.append((line_no, parse_row(raw)))
+        except ValueError as e:
+            isbn = raw.get("isbn") if isinstance(raw, dict) else None
+            reject(line_no, _text(isbn), str(e))
+
+        if len(chunk) >= chunk_size:
+            _flush_chunk(database, chunk, report, reject)
+            chunk = []
+            _progress(report, start, progress)
+
+    if chunk:
+        _flush_chunk(database, chunk, report, reject)
+
+    # Cached books and searches may describe rows that just changed
+    database.clear_caches()
+    _progress(report, start, progress)
+    return report
+
+
+def _flush_chunk(database, chunk, report, reject):
+    # Runs on the database writer; rejected rows are reported after commit
+    counts = database.write(lambda cursor: _apply_chunk(cursor, chunk))
+    report["inserted"] += counts["inserted"]
+    report["updated"] += counts["updated"]
+    for error in counts["rejected"]:
+        reject(*error)
+
+
+def _progress(report, start, progress):
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["rows_per_sec"] = round(report["rows"] / report["seconds"]) if report["seconds"] else 0.0
+    if progress:
+        progress(report)
+
+
+def export_books(out, fmt: str = "csv", chunk_size: int = BULK_CHUNK_SIZE, database=None) -> int:
+    """Stream every book (isbn, title, author, price, stock) to a text file object"""
+    database = database or db
+    count = 0
+
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT isbn, title, author, price, stock FROM books ORDER BY isbn")
+
+        writer = csv.writer(out) if fmt == "csv" else None
+        if writer:
+            writer.writerow(FIELDS)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(tuple(row) for row in rows)
+            else:
+                out.writelines(json.dumps(dict(row)) + "\n" for row in rows)
+            count += len(rows)
+
+    return count
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of the books catalogue")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="upsert books and apply stock changes from a file")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=("csv", "jsonl"))
+    imp.add_argument("--chunk", type=int, default=BULK_CHUNK_SIZE, help="rows per transaction")
+    imp.add_argument("--errors", help="write rejected rows (line, isbn, error) to this CSV file")
+
+    exp = sub.add_parser("export", help="write the catalogue with current stock to a file")
+    exp.add_argument("path", help="output file, or - for stdout")
+    exp.add_argument("--format", choices=("csv", "jsonl"))
+
+    args = parser.parse_args(argv)
+    db.init_database()
+
+    if args.command == "export":
+        fmt = _format(args.path, args.format)
+        if args.path == "-":
+            count = export_books(sys.stdout, fmt)
+        else:
+            with open(args.path, "w", newline="", encoding="utf-8") as out:
+                count = export_books(out, fmt)
+        print(f"Exported {count} books", file=sys.stderr)
+        return
+
+    errors_file = open(args.errors, "w", newline="", encoding="utf-8") if args.errors else None
+    try:
+        on_error = None
+        if errors_file:
+            error_writer = csv.writer(errors_file)
+            error_writer.writerow(("line", "isbn", "error"))
+            on_error = lambda line, isbn, message: error_writer.writerow((line, isbn, message))
+
+        def progress(report):
+            print(f"\r  {report['rows']} rows, {report['errors']} rejected "
+                  f"({report['rows_per_sec']:.0f} rows/s)", end="", file=sys.stderr, flush=True)
+
+        report = import_books(args.path, args.format, args.chunk,
+                              progress=progress, on_error=on_error)
+    finally:
+        if errors_file:
+            errors_file.close()
+
+    print(file=sys.stderr)
+    print(f"Imported {report['rows']} rows in {report['seconds']}s: "
+          f"{report['inserted']} new, {report['updated']} updated, {report['errors']} rejected")
+    for error in report["error_rows"][:10]:
+        print(f"  line {error['line']} ({error['isbn']}): {error['error']}")
+    if report["errors"] > 10 and not args.errors:
+        print("  ... use --errors FILE to get every rejected row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Token-budgeted conversation context for the agent
+"""
+
+import os
+import re
+from typing import List
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+
+# Tokens of history (recent turns + summary) sent with each model call
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Longest single message kept verbatim; bulkier tool output is compacted
+CONTEXT_MESSAGE_TOKENS = int(os.getenv("CONTEXT_MESSAGE_TOKENS", "250"))
+# Share of the budget the summary of older turns may use
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300"))
+
+# Per-message framing (role, separators) in chat-completion requests
+MESSAGE_OVERHEAD = 4
+SUMMARY_LINE_CHARS = 100
+SUMMARY_HEADER_TOKENS = 16
+
+ISBN = re.compile(r"ISBN:?\s*([0-9Xx-]{10,17})")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count (~4 characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message) -> int:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+
+def _clip(text: str, limit: int = SUMMARY_LINE_CHARS) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def _references(lines: List[str]) -> List[str]:
+    """One short "title (ISBN)" reference per block of tool output that names a book"""
+    refs = []
+    block = []
+    for line in lines + [""]:
+        if line.strip():
+            block.append(line.strip())
+            continue
+        if block:
+            match = ISBN.search("\n".join(block))
+            if match:
+                label = block[0] if not ISBN.match(block[0]) else ""
+                refs.append(f"{_clip(label, 40)} ({match.group(1)})" if label else match.group(1))
+        block = []
+    return refs
+
+
+def compact_output(text: str, max_tokens: int = CONTEXT_MESSAGE_TOKENS) -> str:
+    """Trim bulky output to its leading lines plus references to what was cut.
+
+    Books in the dropped part are kept as "title (ISBN)" references so the
+    model can still refer to (or look up) them on a later turn.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    lines = text.splitlines()
+    kept = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if kept and used + cost > max_tokens // 2:
+            break
+        kept.append(line)
+        used += cost
+
+    # Cut between blocks, not through one
+    if len(kept) < len(lines) and lines[len(kept)].strip() and "" in kept[1:]:
+        while kept[-1].strip():
+            used -= count_tokens(kept.pop()) + 1
+
+    dropped = lines[len(kept):]
+    if not dropped or count_tokens(kept[-1]) > max_tokens // 2:
+        # One overlong line: keep its head
+        head = kept.pop()[:max_tokens * 2]
+        kept.append(head)
+        used = sum(count_tokens(line) + 1 for line in kept)
+    note = f"[... {len(dropped)} more line(s) omitted" if dropped else "[... truncated"
+
+    refs = _references(dropped)
+    listed = []
+    for ref in refs:
+        cost = count_tokens(ref) + 1
+        if used + count_tokens(note) + cost + 8 > max_tokens:
+            break
+        listed.append(ref)
+        used += cost
+    if listed:
+        note += "; also: " + "; ".join(listed)
+    if len(refs) > len(listed):
+        note += f"; +{len(refs) - len(listed)} more book(s)"
+
+    return "\n".join(kept).rstrip() + "\n" + note + "]"
+
+
+class ConversationContext:
+    """Recent turns kept within a token budget; older turns become a summary.
+
+    Turns are stored compacted, so a large tool result costs at most
+    max_message_tokens on every later request. When the recent turns no
+    longer fit, the oldest are folded into a one-line-per-turn summary that
+    is cached and only rebuilt when another turn is folded in.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET,
+                 max_message_tokens: int = CONTEXT_MESSAGE_TOKENS,
+                 summary_tokens: int = CONTEXT_SUMMARY_TOKENS):
+        self.budget = budget
+        self.max_message_tokens = max_message_tokens
+        self.summary_tokens = min(summary_tokens, budget // 2)
+
+        self.messages = []
+        self.summary = ""
+        self.folded = 0
+        self._summary_lines = []
+        self._tokens = 0
+
+    def reset(self, messages=()):
+        """Replace the context, e.g. with history loaded from the database"""
+        self.messages = []
+        self.summary = ""
+        self.folded = 0
+        self._summary_lines = []
+        self._tokens = 0
+        for message in messages:
+            self._append(message)
+        self._fit()
+
+    def add_turn(self, user: str, assistant: str):
+        self._append(HumanMessage(content=user))
+        self._append(AIMessage(content=assistant))
+        self._fit()
+
+    def _append(self, message):
+        if isinstance(message.content, str):
+            compacted = compact_output(message.content, self.max_message_tokens)
+            if compacted != message.content:
+                message = type(message)(content=compacted)
+        self.messages.append(message)
+        self._tokens += message_tokens(message)
+
+    def _fit(self):
+        changed = False
+        # Once anything is folded, part of the budget is held for the summary
+        limit = self.budget
+        if self.folded or self._tokens > self.budget:
+            limit -= self.summary_tokens
+
+        while len(self.messages) > 2 and self._tokens > limit:
+            user = self.messages.pop(0)
+            self._tokens -= message_tokens(user)
+            reply = None
+            if isinstance(user, HumanMessage) and self.messages and isinstance(self.messages[0], AIMessage):
+                reply = self.messages.pop(0)
+                self._tokens -= message_tokens(reply)
+            self._fold(user, reply)
+            changed = True
+
+        if changed:
+            self._rebuild_summary()
+
+    def _fold(self, first, reply):
+        if isinstance(first, HumanMessage):
+            line = f"- User: {_clip(first.content)}"
+            if reply is not None:
+                answer = next((l for l in reply.content.splitlines() if l.strip()), "")
+                line += f" -> Agent: {_clip(answer)}"
+        else:
+            line = f"- Agent: {_clip(first.content)}"
+        self._summary_lines.append(line)
+        self.folded += 1
+
+    def _rebuild_summary(self):
+        # Keep the newest lines that fit; older ones are only counted
+        lines, used = [], SUMMARY_HEADER_TOKENS
+        for line in reversed(self._summary_lines):
+            cost = count_tokens(line) + 1
+            if used + cost > self.summary_tokens:
+                break
+            lines.append(line)
+            used += cost
+        lines.reverse()
+        self._summary_lines = lines
+
+        header = "Earlier in this conversation"
+        if self.folded > len(lines):
+            header += f" ({self.folded - len(lines)} older turn(s) not shown)"
+        self.summary = header + ":\n" + "\n".join(lines)
+
+    def tokens(self) -> int:
+        """Tokens of history this context adds to a request"""
+        summary = count_tokens(self.summary) + 1 if self.summary else 0
+        return self._tokens + summary
+
+    def build(self, system_prompt: str, msg: str) -> List:
+        """Messages for a model call: system prompt (+ summary), recent turns, new message"""
+        prompt = system_prompt
+        if self.summary:
+            prompt += "\n\n" + self.summary
+        return [SystemMessage(content=prompt), *self.messages, HumanMessage(content=msg)]
@@ -2,334 +2,1014 @@
 Database module for Library Agent
 """
 
+import os
+import queue
+import re
 import sqlite3
 import json
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List, Dict, Any, Optional
+from cache import LRUCache, MISSING
+from write_queue import WriteQueue, WRITE_TIMEOUT
+from tracing import TRACER, TracedConnection, traced_methods, in_context
 
 
-DB_PATH = Path(__file__).parent.parent / "db" / "library.db"
+DB_PATH = Path(os.getenv("LIBRARY_DB") or Path(__file__).parent.parent / "db" / "library.db")
 
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
 
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "5"))
+
+CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "2048"))
+CACHE_TTL = float(os.getenv("DB_CACHE_TTL", "30"))
+
+# Default look-back window for sales reports
+REPORT_DAYS = int(os.getenv("REPORT_DAYS", "30"))
+
+# Candidates listed per ambiguous book reference (the rest are only counted)
+RESOLVE_CANDIDATES = int(os.getenv("RESOLVE_CANDIDATES", "10"))
+
+# Seconds a stock reservation holds copies for an order in progress
+RESERVATION_TTL = float(os.getenv("STOCK_RESERVATION_TTL", "900"))
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections"""
+
+    def __init__(self, db_path, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 busy_timeout: int = BUSY_TIMEOUT_MS):
+        self.db_path = str(db_path)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _connect(self):
+        """Open a connection and apply per-connection PRAGMAs once"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            # Statement timings and row counts for the current trace
+            factory=TracedConnection if TRACER.enabled else sqlite3.Connection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        """Take an idle connection, open a new one, or wait for a release"""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._created < self.size
+            if can_open:
+                self._created += 1
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No database connection available after {self.timeout}s "
+                f"(pool size {self.size})"
+            )
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            # Waiters block on the idle queue, so hand them a fresh connection
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> Dict:
+        """Pool counters"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits
+            }
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+# Every query method gets a span when called during a traced turn
+@traced_methods("db", exclude={
+    'get_connection', 'connection', 'write', 'pool_stats', 'cache_stats', 'write_stats',
+    'invalidate_books', 'clear_caches', 'close'
+})
 class Database:
     """Database handler"""
-    
-    def __init__(self, db_path: str = None):
-        self.db_path = db_path or DB_PATH
+
+    def __init__(self, db_path: str = None, pool_size: int = POOL_SIZE,
+                 busy_timeout: int = BUSY_TIMEOUT_MS,
+                 low_stock_threshold: int = LOW_STOCK_THRESHOLD):
+        self.db_path = Path(db_path) if db_path else DB_PATH
+        self.low_stock_threshold = low_stock_threshold
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-    
+        self.pool = ConnectionPool(self.db_path, size=pool_size, busy_timeout=busy_timeout)
+
+        # Read-through caches; writes below invalidate the affected entries
+        self.book_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+        self.customer_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+        self.search_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+
+        # All mutations go through one writer thread and are group-committed
+        self.writer = WriteQueue(self.get_connection)
+
     def get_connection(self):
-        conn = sqlite3.connect(str(self.db_path))
-        conn.row_factory = sqlite3.Row
-        return conn
-    
+        """Open a standalone connection outside the pool (caller closes it)"""
+        return self.pool._connect()
+
+    def connection(self):
+        """Borrow a pooled connection for the duration of a `with` block"""
+        return self.pool.connection()
+
+    def write(self, op, timeout: float = WRITE_TIMEOUT):
+        """Run op(cursor) on the writer thread and return its result.
+
+        op runs inside its own savepoint: raising rolls back only its changes.
+        It must not commit or call write() itself.
+        """
+        # op's statements count towards the caller's trace, though they run on the writer
+        return self.writer.execute(in_context(op), timeout)
+
+    def pool_stats(self) -> Dict:
+        """Connection pool hit/miss/wait counters"""
+        return self.pool.stats()
+
+    def cache_stats(self) -> Dict:
+        """Hit-rate statistics for the read-through caches"""
+        return {
+            'books': self.book_cache.stats(),
+            'customers': self.customer_cache.stats(),
+            'searches': self.search_cache.stats()
+        }
+
+    def invalidate_books(self, isbns):
+        """Drop cached books and every cached search that contained them"""
+        for isbn in isbns:
+            self.book_cache.pop(isbn)
+            self.search_cache.invalidate_tag(isbn)
+
+    def clear_caches(self):
+        self.book_cache.clear()
+        self.customer_cache.clear()
+        self.search_cache.clear()
+
+    def write_stats(self) -> Dict:
+        """Writer queue depth and group-commit counters"""
+        return self.writer.stats()
+
+    def close(self):
+        self.writer.close()
+        self.pool.close()
+
     def init_database(self):
-        schema_path = Path(__file__).parent.parent / "db" / "schema.sql"
-        seed_path = Path(__file__).parent.parent / "db" / "seed.sql"
-        
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            if schema_path.exists():
-                with open(schema_path) as f:
-                    cursor.executescript(f.read())
-            
-            cursor.execute("SELECT COUNT(*) as count FROM books")
-            if cursor.fetchone()['count'] == 0:
-                if seed_path.exists():
-                    with open(seed_path) as f:
+        schema_path = Path(__file__).parent.parent / "db" / "Schema.sql"
+        seed_path = Path(__file__).parent.parent / "db" / "Seed.sql"
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                # Columns added after a database was first created
+                cursor.execute("PRAGMA table_info(tool_calls)")
+                columns = {row['name'] for row in cursor.fetchall()}
+                if columns and 'duration_ms' not in columns:
+                    cursor.execute("ALTER TABLE tool_calls ADD COLUMN duration_ms REAL")
+
+                # The search index used to be keyed on books' implicit rowid, which
+                # VACUUM may renumber; give books a stable key and re-create the index
+                cursor.execute("PRAGMA table_info(books)")
+                columns = {row['name'] for row in cursor.fetchall()}
+                if columns and 'book_id' not in columns:
+                    cursor.execute("ALTER TABLE books ADD COLUMN book_id INTEGER")
+                    cursor.execute("UPDATE books SET book_id = rowid")
+                    for trigger in ('books_fts_insert', 'books_fts_delete', 'books_fts_update'):
+                        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                    cursor.execute("DROP TABLE IF EXISTS books_fts")
+
+                if schema_path.exists():
+                    with open(schema_path) as f:
                         cursor.executescript(f.read())
-            
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
-    
-    def find_books(self, query: str, by: str = "title") -> List[Dict]:
-        
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            if by == "author":
+
+                cursor.execute("SELECT COUNT(*) as count FROM books")
+                if cursor.fetchone()['count'] == 0:
+                    if seed_path.exists():
+                        with open(seed_path) as f:
+                            cursor.executescript(f.read())
+
+                # Backfill the search index for catalogues loaded before it existed
+                cursor.execute("SELECT COUNT(*) as count FROM books_fts_docsize")
+                indexed = cursor.fetchone()['count']
+                cursor.execute("SELECT COUNT(*) as count FROM books")
+                if indexed != cursor.fetchone()['count']:
+                    cursor.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def _fts_query(query: str, by: str) -> Optional[str]:
+        """Build an FTS5 MATCH expression with prefix matching on the last word"""
+        words = re.findall(r"\w+", query)
+        if not words:
+            return None
+
+        if by == "any":
+            # Every word must match, in either column
+            return " AND ".join(f'"{w}"*' for w in words)
+
+        column = "author" if by == "author" else "title"
+        return f'{column} : "{" ".join(words)}"*'
+
+    def find_books(self, query: str, by: str = "title", limit: Optional[int] = None) -> List[Dict]:
+        """Ranked full-text search by 'title', 'author' or 'any' (both)"""
+        key = (query, by, limit)
+        books = self.search_cache.get(key)
+        if books is not MISSING:
+            return [dict(book) for book in books]
+
+        match = self._fts_query(query, by)
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            if match is None:
+                # Nothing tokenizable (punctuation only) - plain substring scan
+                column = "author" if by == "author" else "title"
                 cursor.execute(
-                    "SELECT * FROM books WHERE author LIKE ? ORDER BY title",
-                    (f"%{query}%",)
+                    f"SELECT * FROM books WHERE {column} LIKE ? ORDER BY title LIMIT ?",
+                    (f"%{query}%", limit or -1)
                 )
             else:
-                cursor.execute(
-                    "SELECT * FROM books WHERE title LIKE ? ORDER BY title",
-                    (f"%{query}%",)
+                cursor.execute("""
+                    SELECT b.*
+                    FROM books_fts
+                    JOIN books b ON b.book_id = books_fts.rowid
+                    WHERE books_fts MATCH ?
+                    ORDER BY bm25(books_fts), b.title
+                    LIMIT ?
+                """, (match, limit or -1))
+
+            books = [dict(row) for row in cursor.fetchall()]
+
+        self.search_cache.set(key, books, tags=[book['isbn'] for book in books])
+        return [dict(book) for book in books]
+
+    def resolve_books(self, refs: List[str], limit: int = RESOLVE_CANDIDATES) -> Dict:
+        """Resolve a batch of ISBNs or titles in one query.
+
+        Returns {'matches': {ref: book}, 'ambiguous': {ref: [books]},
+        'more': {ref: count}, 'missing': [refs]}. An ISBN hit wins; otherwise
+        a title search that yields one book, or one book whose title equals
+        the ref exactly, counts as a match. An ambiguous ref lists at most
+        limit candidates (exact titles first); 'more' counts the rest.
+        """
+        refs = list(dict.fromkeys(refs))
+        payload = json.dumps([[ref, self._fts_query(ref, "title")] for ref in refs])
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                WITH refs AS (
+                    SELECT key AS idx,
+                           json_extract(value, '$[0]') AS ref,
+                           json_extract(value, '$[1]') AS match
+                    FROM json_each(?)
+                ),
+                hits AS (
+                    SELECT refs.idx, b.isbn, 1 AS exact
+                    FROM refs
+                    JOIN books b ON b.isbn = refs.ref
+                    UNION ALL
+                    SELECT refs.idx, b.isbn, lower(b.title) = lower(trim(refs.ref)) AS exact
+                    FROM refs
+                    JOIN books_fts ON books_fts MATCH refs.match
+                    JOIN books b ON b.book_id = books_fts.rowid
+                    WHERE refs.match IS NOT NULL
+                      AND NOT EXISTS (SELECT 1 FROM books WHERE isbn = refs.ref)
+                ),
+                ranked AS (
+                    SELECT hits.idx, hits.isbn, hits.exact,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY hits.idx ORDER BY hits.exact DESC, b.title, b.isbn
+                           ) AS rank,
+                           COUNT(*) OVER (PARTITION BY hits.idx) AS total
+                    FROM hits
+                    JOIN books b ON b.isbn = hits.isbn
                 )
-            
-            return [dict(row) for row in cursor.fetchall()]
-        finally:
-            conn.close()
-    
+                SELECT ranked.idx, ranked.exact, ranked.total, b.*
+                FROM ranked
+                JOIN books b ON b.isbn = ranked.isbn
+                WHERE ranked.rank <= ?
+                ORDER BY ranked.idx, ranked.rank
+            """, (payload, max(1, limit)))
+
+            candidates = {}
+            totals = {}
+            for row in cursor.fetchall():
+                book = dict(row)
+                idx = book.pop('idx')
+                totals[idx] = book.pop('total')
+                candidates.setdefault(idx, []).append(book)
+
+        result = {'matches': {}, 'ambiguous': {}, 'more': {}, 'missing': []}
+        for idx, ref in enumerate(refs):
+            books = candidates.get(idx, [])
+            exact = [b for b in books if b.pop('exact')]
+
+            if totals.get(idx) == 1:
+                result['matches'][ref] = books[0]
+            elif len(exact) == 1:
+                result['matches'][ref] = exact[0]
+            elif books:
+                result['ambiguous'][ref] = sorted(books, key=lambda b: b['title'])
+                if totals[idx] > len(books):
+                    result['more'][ref] = totals[idx] - len(books)
+            else:
+                result['missing'].append(ref)
+
+        return result
+
     def get_book(self, isbn: str) -> Optional[Dict]:
         """Get book by ISBN"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("SELECT * FROM books WHERE isbn = ?", (isbn,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
-        finally:
-            conn.close()
-    
+        book = self.book_cache.get(isbn)
+        if book is MISSING:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM books WHERE isbn = ?", (isbn,))
+                row = cursor.fetchone()
+                book = dict(row) if row else None
+            self.book_cache.set(isbn, book)
+
+        return dict(book) if book else None
+
     def update_stock(self, isbn: str, quantity: int) -> bool:
-        """Update stock"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        """Add quantity to stock (negative removes); never takes stock below zero"""
+        def op(cursor):
             cursor.execute(
-                "UPDATE books SET stock = stock + ? WHERE isbn = ?",
-                (quantity, isbn)
+                "UPDATE books SET stock = stock + ? WHERE isbn = ? AND stock + ? >= 0",
+                (quantity, isbn, quantity)
             )
-            conn.commit()
             return cursor.rowcount > 0
+
+        try:
+            updated = self.write(op)
         except Exception as e:
-            conn.rollback()
             return False
-        finally:
-            conn.close()
-    
+        self.invalidate_books([isbn])
+        return updated
+
     def update_price(self, isbn: str, price: float) -> bool:
         """Update price"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        def op(cursor):
             cursor.execute(
                 "UPDATE books SET price = ? WHERE isbn = ?",
                 (price, isbn)
             )
-            conn.commit()
             return cursor.rowcount > 0
+
+        try:
+            updated = self.write(op)
         except Exception as e:
-            conn.rollback()
             return False
-        finally:
-            conn.close()
-    
-    def get_inventory_summary(self) -> Dict:
-        """Get inventory summary"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        self.invalidate_books([isbn])
+        return updated
+
+    def get_inventory_summary(self, threshold: Optional[int] = None) -> Dict:
+        """Get inventory summary from the trigger-maintained totals"""
+        if threshold is None:
+            threshold = self.low_stock_threshold
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
             cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_titles,
-                    SUM(stock) as total_books,
-                    SUM(stock * price) as total_value
-                FROM books
+                SELECT total_titles, total_books, total_value
+                FROM inventory_stats
+                WHERE id = 1
             """)
-            summary = dict(cursor.fetchone())
-            
+            row = cursor.fetchone()
+            if row is not None:
+                summary = dict(row)
+                summary['total_value'] = round(summary['total_value'], 2)
+                summary['low_stock_threshold'] = threshold
+
+                cursor.execute("""
+                    SELECT isbn, title, author, stock, price
+                    FROM books
+                    WHERE stock < ?
+                    ORDER BY stock ASC
+                """, (threshold,))
+                summary['low_stock'] = [dict(row) for row in cursor.fetchall()]
+
+                return summary
+
+        # No totals row yet: rebuild it once the pooled connection is back
+        return self.refresh_inventory_stats(threshold)
+
+    def refresh_inventory_stats(self, threshold: Optional[int] = None) -> Dict:
+        """Recompute the running totals from scratch (full scan)"""
+        def op(cursor):
             cursor.execute("""
-                SELECT isbn, title, author, stock, price
+                INSERT OR REPLACE INTO inventory_stats (id, total_titles, total_books, total_value)
+                SELECT 1, COUNT(*), COALESCE(SUM(stock), 0), COALESCE(SUM(stock * price), 0)
                 FROM books
-                WHERE stock < 5
-                ORDER BY stock ASC
             """)
-            summary['low_stock'] = [dict(row) for row in cursor.fetchall()]
-            
-            return summary
-        finally:
-            conn.close()
-    
+
+        self.write(op)
+        return self.get_inventory_summary(threshold)
+
     def get_customer(self, customer_id: int) -> Optional[Dict]:
         """Get customer"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("SELECT * FROM customers WHERE id = ?", (customer_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
-        finally:
-            conn.close()
-    
-    def create_order(self, customer_id: int, items: List[Dict[str, Any]]) -> Dict:
-        """Create order and reduce stock"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        customer = self.customer_cache.get(customer_id)
+        if customer is MISSING:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM customers WHERE id = ?", (customer_id,))
+                row = cursor.fetchone()
+                customer = dict(row) if row else None
+            self.customer_cache.set(customer_id, customer)
+
+        return dict(customer) if customer else None
+
+    @staticmethod
+    def _requested(items: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Total quantity per ISBN (the same ISBN may appear on several lines)"""
+        requested = {}
+        for item in items:
+            requested[item['isbn']] = requested.get(item['isbn'], 0) + item['qty']
+        return requested
+
+    @staticmethod
+    def _available(cursor, isbns: List[str], now: float,
+                   reservation_id: Optional[str] = None) -> Dict[str, Dict]:
+        """Books with stock held by other live reservations subtracted"""
+        cursor.execute("""
+            SELECT b.isbn, b.title, b.price, b.stock,
+                   b.stock - COALESCE((
+                       SELECT SUM(r.quantity)
+                       FROM stock_reservations r
+                       WHERE r.isbn = b.isbn AND r.expires_at > ?
+                         AND r.reservation_id IS NOT ?
+                   ), 0) AS available
+            FROM books b
+            WHERE b.isbn IN (SELECT value FROM json_each(?))
+        """, (now, reservation_id, json.dumps(isbns)))
+        return {row['isbn']: dict(row) for row in cursor.fetchall()}
+
+    def reserve_stock(self, items: List[Dict[str, Any]], ttl: Optional[float] = None) -> Dict:
+        """Hold copies for an order in progress.
+
+        Reserved copies are not available to other orders or reservations
+        until the reservation is used by create_order, released, or expires
+        after ttl seconds (STOCK_RESERVATION_TTL by default).
+        """
+        ttl = RESERVATION_TTL if ttl is None else ttl
+        requested = self._requested(items)
+
+        def op(cursor):
+            now = time.time()
+            cursor.execute("DELETE FROM stock_reservations WHERE expires_at <= ?", (now,))
+
+            books = self._available(cursor, list(requested), now)
+            for isbn, qty in requested.items():
+                book = books.get(isbn)
+                if not book:
+                    raise ValueError(f"Book {isbn} not found")
+                if book['available'] < qty:
+                    raise ValueError(
+                        f"Insufficient stock for {book['title']}. "
+                        f"Available: {book['available']}, Requested: {qty}"
+                    )
+
+            reservation_id = uuid.uuid4().hex
+            expires_at = now + ttl
+            cursor.executemany(
+                """INSERT INTO stock_reservations (reservation_id, isbn, quantity, expires_at)
+                   VALUES (?, ?, ?, ?)""",
+                [(reservation_id, isbn, qty, expires_at) for isbn, qty in requested.items()]
+            )
+
+            return {
+                'reservation_id': reservation_id,
+                'expires_at': expires_at,
+                'items': [
+                    {'isbn': isbn, 'title': books[isbn]['title'], 'quantity': qty}
+                    for isbn, qty in requested.items()
+                ]
+            }
+
+        return self.write(op)
+
+    def release_reservation(self, reservation_id: str) -> bool:
+        """Give reserved copies back; False if the reservation is unknown or expired"""
+        def op(cursor):
+            cursor.execute(
+                "DELETE FROM stock_reservations WHERE reservation_id = ? AND expires_at > ?",
+                (reservation_id, time.time())
+            )
+            return cursor.rowcount > 0
+
+        return self.write(op)
+
+    def create_order(self, customer_id: int, items: List[Dict[str, Any]],
+                     reservation_id: Optional[str] = None) -> Dict:
+        """Create order and reduce stock atomically on the writer thread.
+
+        Stock held by other customers' reservations is not sold. Passing a
+        reservation_id uses (and then removes) that reservation's hold.
+        """
+        requested = self._requested(items)
+
+        def op(cursor):
+            now = time.time()
+
             cursor.execute("SELECT id FROM customers WHERE id = ?", (customer_id,))
             if not cursor.fetchone():
                 raise ValueError(f"Customer {customer_id} not found")
-            
+
+            if reservation_id is not None:
+                cursor.execute(
+                    "SELECT 1 FROM stock_reservations WHERE reservation_id = ? AND expires_at > ?",
+                    (reservation_id, now)
+                )
+                if not cursor.fetchone():
+                    raise ValueError(f"Reservation {reservation_id} not found or expired")
+
+            books = self._available(cursor, list(requested), now, reservation_id)
+
             total_amount = 0
             order_items = []
-            
+            running = {}
+
             for item in items:
                 isbn = item['isbn']
                 qty = item['qty']
-                
-                cursor.execute("SELECT * FROM books WHERE isbn = ?", (isbn,))
-                book = cursor.fetchone()
-                
+
+                book = books.get(isbn)
                 if not book:
                     raise ValueError(f"Book {isbn} not found")
-                
-                book = dict(book)
-                
-                if book['stock'] < qty:
+
+                running[isbn] = running.get(isbn, 0) + qty
+                if book['available'] < running[isbn]:
                     raise ValueError(
                         f"Insufficient stock for {book['title']}. "
-                        f"Available: {book['stock']}, Requested: {qty}"
+                        f"Available: {book['available']}, Requested: {running[isbn]}"
                     )
-                
+
                 item_total = book['price'] * qty
                 total_amount += item_total
-                
+
                 order_items.append({
                     'isbn': isbn,
                     'quantity': qty,
                     'price': book['price'],
                     'title': book['title']
                 })
-            
+
             cursor.execute(
                 "INSERT INTO orders (customer_id, total_amount, status) VALUES (?, ?, ?)",
                 (customer_id, total_amount, 'completed')
             )
             order_id = cursor.lastrowid
-            
-            for item in order_items:
-                cursor.execute(
-                    """INSERT INTO order_items (order_id, isbn, quantity, price_at_purchase)
-                       VALUES (?, ?, ?, ?)""",
-                    (order_id, item['isbn'], item['quantity'], item['price'])
-                )
-                
+
+            cursor.executemany(
+                """INSERT INTO order_items (order_id, isbn, quantity, price_at_purchase)
+                   VALUES (?, ?, ?, ?)""",
+                [(order_id, item['isbn'], item['quantity'], item['price']) for item in order_items]
+            )
+
+            # Conditional decrement: a row is only touched if enough unreserved
+            # stock is left, so a concurrent writer can never oversell
+            cursor.execute("""
+                UPDATE books
+                SET stock = stock - wanted.qty
+                FROM (
+                    SELECT json_extract(value, '$[0]') AS isbn,
+                           json_extract(value, '$[1]') AS qty
+                    FROM json_each(?)
+                ) AS wanted
+                WHERE books.isbn = wanted.isbn
+                  AND books.stock - COALESCE((
+                      SELECT SUM(r.quantity)
+                      FROM stock_reservations r
+                      WHERE r.isbn = books.isbn AND r.expires_at > ?
+                        AND r.reservation_id IS NOT ?
+                  ), 0) >= wanted.qty
+                RETURNING books.isbn, books.title, books.stock
+            """, (json.dumps(list(requested.items())), now, reservation_id))
+            updated = {row['isbn']: dict(row) for row in cursor.fetchall()}
+
+            for isbn, qty in requested.items():
+                if isbn not in updated:
+                    book = books[isbn]
+                    raise ValueError(
+                        f"Insufficient stock for {book['title']}. "
+                        f"Available: {book['available']}, Requested: {qty}"
+                    )
+
+            if reservation_id is not None:
                 cursor.execute(
-                    "UPDATE books SET stock = stock - ? WHERE isbn = ?",
-                    (item['quantity'], item['isbn'])
+                    "DELETE FROM stock_reservations WHERE reservation_id = ?",
+                    (reservation_id,)
                 )
-            
-            conn.commit()
-            
-            updated_books = []
-            for item in order_items:
-                cursor.execute("SELECT isbn, title, stock FROM books WHERE isbn = ?", (item['isbn'],))
-                updated_books.append(dict(cursor.fetchone()))
-            
+
             return {
                 'order_id': order_id,
                 'total_amount': total_amount,
                 'items': order_items,
-                'updated_stock': updated_books
+                'updated_stock': [updated[item['isbn']] for item in order_items]
             }
-        
-        except Exception as e:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
-    
+
+        result = self.write(op)
+        self.invalidate_books(requested)
+        return result
+
     def get_order_status(self, order_id: int) -> Optional[Dict]:
         """Get order details"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
             cursor.execute("""
                 SELECT o.*, c.name as customer_name, c.email as customer_email
                 FROM orders o
                 JOIN customers c ON o.customer_id = c.id
                 WHERE o.id = ?
             """, (order_id,))
-            
+
             order = cursor.fetchone()
             if not order:
                 return None
-            
+
             order = dict(order)
-            
+
             cursor.execute("""
                 SELECT oi.*, b.title, b.author
                 FROM order_items oi
                 JOIN books b ON oi.isbn = b.isbn
                 WHERE oi.order_id = ?
             """, (order_id,))
-            
+
             order['items'] = [dict(row) for row in cursor.fetchall()]
-            
+
             return order
-        finally:
-            conn.close()
-    
+
+    @staticmethod
+    def _date_range(start: Optional[str] = None, end: Optional[str] = None,
+                    days: Optional[int] = None) -> tuple:
+        """Inclusive (start, end) ISO dates; defaults to the last `days` days up to today (UTC)"""
+        end_day = date.fromisoformat(end) if end else datetime.now(timezone.utc).date()
+        if start:
+            start_day = date.fromisoformat(start)
+        else:
+            start_day = end_day - timedelta(days=max(1, days or REPORT_DAYS) - 1)
+        if start_day > end_day:
+            raise ValueError(f"start {start_day} is after end {end_day}")
+        return start_day.isoformat(), end_day.isoformat()
+
+    def sales_report(self, start: Optional[str] = None, end: Optional[str] = None,
+                     days: Optional[int] = None, by: str = "title",
+                     sort: str = "quantity", limit: int = 10) -> Dict:
+        """Best sellers by 'title' or 'author' over a date range, from the daily rollup"""
+        start, end = self._date_range(start, end, days)
+        order = "revenue" if sort == "revenue" else "quantity"
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            if by == "author":
+                cursor.execute(f"""
+                    SELECT b.author, COUNT(*) AS titles,
+                           SUM(t.quantity) AS quantity, SUM(t.revenue) AS revenue,
+                           SUM(t.order_lines) AS order_lines
+                    FROM (
+                        SELECT isbn, SUM(quantity) AS quantity, SUM(revenue) AS revenue,
+                               SUM(order_lines) AS order_lines
+                        FROM sales_daily
+                        WHERE day BETWEEN ? AND ?
+                        GROUP BY isbn
+                    ) AS t
+                    JOIN books b ON b.isbn = t.isbn
+                    GROUP BY b.author
+                    ORDER BY {order} DESC, b.author
+                    LIMIT ?
+                """, (start, end, limit))
+            else:
+                cursor.execute(f"""
+                    SELECT b.isbn, b.title, b.author,
+                           t.quantity, t.revenue, t.order_lines
+                    FROM (
+                        SELECT isbn, SUM(quantity) AS quantity, SUM(revenue) AS revenue,
+                               SUM(order_lines) AS order_lines
+                        FROM sales_daily
+                        WHERE day BETWEEN ? AND ?
+                        GROUP BY isbn
+                    ) AS t
+                    JOIN books b ON b.isbn = t.isbn
+                    ORDER BY t.{order} DESC, b.title
+                    LIMIT ?
+                """, (start, end, limit))
+
+            rows = [dict(row) for row in cursor.fetchall()]
+
+        return {'start': start, 'end': end, 'by': by, 'sort': order, 'rows': rows}
+
+    def revenue_by_customer(self, start: Optional[str] = None, end: Optional[str] = None,
+                            days: Optional[int] = None, limit: int = 10) -> Dict:
+        """Order count and revenue per customer over a date range"""
+        start, end = self._date_range(start, end, days)
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # Range scan on the covering idx_orders_created; no table reads
+            cursor.execute("""
+                SELECT c.id AS customer_id, c.name, c.email,
+                       t.orders, t.revenue, t.last_order
+                FROM (
+                    SELECT customer_id, COUNT(*) AS orders, SUM(total_amount) AS revenue,
+                           MAX(created_at) AS last_order
+                    FROM orders
+                    WHERE created_at >= ? AND created_at < date(?, '+1 day')
+                    GROUP BY customer_id
+                ) AS t
+                JOIN customers c ON c.id = t.customer_id
+                ORDER BY t.revenue DESC, c.name
+                LIMIT ?
+            """, (start, end, limit))
+            rows = [dict(row) for row in cursor.fetchall()]
+
+        return {'start': start, 'end': end, 'rows': rows}
+
+    def stock_turnover(self, start: Optional[str] = None, end: Optional[str] = None,
+                       days: Optional[int] = None, slowest: bool = False,
+                       limit: int = 10) -> Dict:
+        """Units sold against stock held, fastest (or slowest) movers first.
+
+        turnover = sold / average stock, where average stock is estimated as
+        current stock + sold / 2 (stock history is not kept). days_of_cover is
+        how long current stock lasts at the period's sales rate.
+
+        Fast movers are ranked from the period's sales_daily rows only. Slow
+        movers include books that never sold, so slowest=True scans and sorts
+        the whole catalogue.
+        """
+        start, end = self._date_range(start, end, days)
+        period = (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+        columns = """
+            b.isbn, b.title, b.author, b.stock,
+            COALESCE(t.sold, 0) AS sold,
+            ROUND(COALESCE(t.sold, 0) / MAX(b.stock + COALESCE(t.sold, 0) / 2.0, 1), 3) AS turnover,
+            CASE WHEN t.sold > 0 THEN ROUND(b.stock * ? / CAST(t.sold AS REAL), 1) END AS days_of_cover
+        """
+        sold = """
+            SELECT isbn, SUM(quantity) AS sold
+            FROM sales_daily
+            WHERE day BETWEEN ? AND ?
+            GROUP BY isbn
+        """
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if slowest:
+                cursor.execute(f"""
+                    SELECT {columns}
+                    FROM books b
+                    LEFT JOIN ({sold}) AS t ON t.isbn = b.isbn
+                    ORDER BY turnover ASC, b.title
+                    LIMIT ?
+                """, (period, start, end, limit))
+                rows = [dict(row) for row in cursor.fetchall()]
+            else:
+                cursor.execute(f"""
+                    SELECT {columns}
+                    FROM ({sold} HAVING SUM(quantity) > 0) AS t
+                    JOIN books b ON b.isbn = t.isbn
+                    ORDER BY turnover DESC, b.title
+                    LIMIT ?
+                """, (period, start, end, limit))
+                rows = [dict(row) for row in cursor.fetchall()]
+
+                if len(rows) < limit:
+                    # Fewer sellers than asked for: the rest sold nothing, by title
+                    cursor.execute("""
+                        SELECT isbn, title, author, stock, 0 AS sold, 0.0 AS turnover,
+                               NULL AS days_of_cover
+                        FROM books
+                        WHERE isbn NOT IN (SELECT value FROM json_each(?))
+                        ORDER BY title
+                        LIMIT ?
+                    """, (json.dumps([row['isbn'] for row in rows]), limit - len(rows)))
+                    rows += [dict(row) for row in cursor.fetchall()]
+
+        return {'start': start, 'end': end, 'days': period, 'slowest': slowest, 'rows': rows}
+
     def log_message(self, session_id: str, role: str, content: str):
         """Log chat message"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+        # Ensure content is a string
+        if not isinstance(content, str):
+            content = str(content)
+
         try:
-            # Ensure content is a string
-            if not isinstance(content, str):
-                content = str(content)
-            
-            cursor.execute(
-                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
-                (session_id, role, content)
-            )
-            conn.commit()
+            self.write_log_batch([(session_id, role, content)], [])
         except Exception as e:
-            conn.rollback()
-        finally:
-            conn.close()
-    
+            pass
+
     def get_session_history(self, session_id: str) -> List[Dict]:
         """Get chat history"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                "SELECT * FROM messages WHERE session_id = ? ORDER BY created_at",
+                "SELECT * FROM messages WHERE session_id = ? ORDER BY id",
                 (session_id,)
             )
             return [dict(row) for row in cursor.fetchall()]
-        finally:
-            conn.close()
-    
+
+    def get_recent_messages(self, session_id: str, limit: int = 10) -> List[Dict]:
+        """Last `limit` messages of a session, oldest first"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)
+            )
+            return [dict(row) for row in reversed(cursor.fetchall())]
+
+    def iter_session_history(self, session_id: str, page_size: int = 50,
+                             before_id: Optional[int] = None):
+        """Yield pages of a session's messages, newest page first.
+
+        Each page is in chronological order; older pages are only read when
+        the caller asks for them.
+        """
+        while True:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                if before_id is None:
+                    cursor.execute(
+                        "SELECT * FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                        (session_id, page_size)
+                    )
+                else:
+                    cursor.execute(
+                        """SELECT * FROM messages WHERE session_id = ? AND id < ?
+                           ORDER BY id DESC LIMIT ?""",
+                        (session_id, before_id, page_size)
+                    )
+                rows = [dict(row) for row in cursor.fetchall()]
+
+            if not rows:
+                return
+
+            yield rows[::-1]
+
+            if len(rows) < page_size:
+                return
+            before_id = rows[-1]['id']
+
     def get_all_sessions(self) -> List[str]:
         """Get all session IDs"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                "SELECT DISTINCT session_id FROM messages ORDER BY session_id"
+                "SELECT session_id FROM sessions ORDER BY session_id"
             )
             return [row['session_id'] for row in cursor.fetchall()]
-        finally:
-            conn.close()
-    
-    def log_tool_call(self, session_id: str, tool_name: str, args: Dict, result: Any):
+
+    def list_sessions(self, limit: int = 20, after: Optional[tuple] = None) -> List[Dict]:
+        """Sessions with message count and last activity, most recent first.
+
+        Keyset pagination: pass the (last_activity, session_id) of the last
+        row of the previous page as `after` to get the next page.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            if after is None:
+                cursor.execute("""
+                    SELECT session_id, message_count, last_activity
+                    FROM sessions
+                    ORDER BY last_activity DESC, session_id DESC
+                    LIMIT ?
+                """, (limit,))
+            else:
+                cursor.execute("""
+                    SELECT session_id, message_count, last_activity
+                    FROM sessions
+                    WHERE (last_activity, session_id) < (?, ?)
+                    ORDER BY last_activity DESC, session_id DESC
+                    LIMIT ?
+                """, (after[0], after[1], limit))
+
+            return [dict(row) for row in cursor.fetchall()]
+
+    def count_sessions(self) -> int:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) as count FROM sessions")
+            return cursor.fetchone()['count']
+
+    def log_tool_call(self, session_id: str, tool_name: str, args: Dict, result: Any,
+                      duration_ms: Optional[float] = None):
         """Log tool call"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute(
-                """INSERT INTO tool_calls (session_id, tool_name, args_json, result_json)
-                   VALUES (?, ?, ?, ?)""",
-                (session_id, tool_name, json.dumps(args), json.dumps(result, default=str))
-            )
-            conn.commit()
+            self.write_log_batch([], [(session_id, tool_name, args, result, duration_ms)])
         except Exception as e:
-            conn.rollback()
-        finally:
-            conn.close()
+            pass
+
+    def write_log_batch(self, messages: List[tuple], tool_calls: List[tuple]):
+        """Write queued messages and tool calls in one transaction.
+
+        messages: (session_id, role, content)
+        tool_calls: (session_id, tool_name, args, result, duration_ms)
+        """
+        rows = [
+            (session_id, tool_name, json.dumps(args, default=str),
+             json.dumps(result, default=str), duration_ms)
+            for session_id, tool_name, args, result, duration_ms in tool_calls
+        ]
+
+        def op(cursor):
+            if messages:
+                cursor.executemany(
+                    "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                    messages
+                )
+            if rows:
+                cursor.executemany(
+                    """INSERT INTO tool_calls (session_id, tool_name, args_json, result_json, duration_ms)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    rows
+                )
+
+        self.write(op)
 
 
-db = Database()
\ No newline at end of file
+db = Database()
@@ -0,0 +1,311 @@
+"""
+Multi-session desk server: every desk terminal talks to one process and one database.
+
+Protocol: newline-delimited JSON over TCP or a Unix socket. Each request is
+one object per line; each response echoes the request's "id".
+
+    {"id": 1, "op": "chat", "session": "desk-3", "message": "inventory summary"}
+    {"id": 1, "session": "desk-3", "reply": "INVENTORY SUMMARY ..."}
+
+Other ops: "history" (session, limit), "sessions" (limit, after), "stats".
+Failures come back as {"id": ..., "error": "..."}.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+sys.path.insert(0, str(Path(__file__).parent))
+from dotenv import load_dotenv
+from agent_groq import LibraryAgent, DB_EXECUTOR
+from router import ROUTER
+from plan_cache import PLAN_CACHE
+from log_writer import LOG_WRITER
+from database import db
+from tracing import TRACER
+
+
+DESK_HOST = os.getenv("DESK_HOST", "127.0.0.1")
+DESK_PORT = int(os.getenv("DESK_PORT", "8765"))
+DESK_SOCKET = os.getenv("DESK_SOCKET")
+# Turns processed at once across all sessions
+DESK_WORKERS = int(os.getenv("DESK_WORKERS", "8"))
+# Pending turns per session before new ones are refused
+SESSION_QUEUE_SIZE = int(os.getenv("DESK_SESSION_QUEUE", "4"))
+# Idle session agents kept in memory
+MAX_SESSIONS = int(os.getenv("DESK_MAX_SESSIONS", "256"))
+MAX_LINE_BYTES = 64 * 1024
+
+
+class Busy(Exception):
+    """A session already has SESSION_QUEUE_SIZE turns waiting"""
+
+
+class DeskServer:
+    """Schedules chat turns from many sessions onto a fixed pool of workers.
+
+    Each session has its own FIFO queue and is handed to at most one worker
+    at a time, so its turns run strictly in order while different sessions
+    run concurrently. A session goes to the back of the ready queue after
+    each turn, which keeps one busy desk from starving the others. Writes
+    from every session are serialized by the database's single writer.
+    """
+
+    def __init__(self, workers: int = DESK_WORKERS, queue_size: int = SESSION_QUEUE_SIZE,
+                 max_sessions: int = MAX_SESSIONS, agent_factory=LibraryAgent):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.max_sessions = max_sessions
+        self.agent_factory = agent_factory
+
+        self.agents = OrderedDict()
+        self.queues = {}
+        self.scheduled = set()
+        self.ready = None
+        self._tasks = []
+        self._servers = []
+
+        self.turns = 0
+        self.rejected = 0
+        self.errors = 0
+
+    async def start(self, host: Optional[str] = DESK_HOST, port: Optional[int] = DESK_PORT,
+                    path: Optional[str] = None):
+        """Start workers and listen on TCP (host, port) and/or a Unix socket path"""
+        self.ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        if path:
+            self._servers.append(await asyncio.start_unix_server(
+                self._handle_client, path=path, limit=MAX_LINE_BYTES
+            ))
+        if port is not None:
+            self._servers.append(await asyncio.start_server(
+                self._handle_client, host, port, limit=MAX_LINE_BYTES
+            ))
+        return self._servers
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._servers, self._tasks = [], []
+
+    def submit(self, session_id: str, message: str) -> asyncio.Future:
+        """Queue a turn; the returned future resolves to the agent's reply"""
+        queue = self.queues.get(session_id)
+        if queue is None:
+            queue = self.queues[session_id] = asyncio.Queue(maxsize=self.queue_size)
+        if queue.full():
+            self.rejected += 1
+            raise Busy(f"session {session_id} has {self.queue_size} turns pending, retry later")
+
+        future = asyncio.get_running_loop().create_future()
+        queue.put_nowait((message, future))
+
+        if session_id not in self.scheduled:
+            self.scheduled.add(session_id)
+            self.ready.put_nowait(session_id)
+        return future
+
+    async def _worker(self):
+        while True:
+            session_id = await self.ready.get()
+            queue = self.queues[session_id]
+            message, future = queue.get_nowait()
+
+            try:
+                agent = await self._agent(session_id)
+                reply = await agent.achat(message)
+                self.turns += 1
+                if not future.done():
+                    future.set_result(reply)
+            except Exception as e:
+                self.errors += 1
+                if not future.done():
+                    future.set_exception(e)
+
+            if queue.empty():
+                self.scheduled.discard(session_id)
+                del self.queues[session_id]
+            else:
+                self.ready.put_nowait(session_id)
+
+    async def _agent(self, session_id: str) -> LibraryAgent:
+        agent = self.agents.get(session_id)
+        if agent is not None:
+            self.agents.move_to_end(session_id)
+            return agent
+
+        agent = self.agent_factory(session_id=session_id)
+        await agent.aload_history()
+        self.agents[session_id] = agent
+
+        # Forget idle sessions; their history is reloaded from the database
+        while len(self.agents) > self.max_sessions:
+            oldest = next((sid for sid in self.agents if sid not in self.scheduled), None)
+            if oldest is None:
+                break
+            del self.agents[oldest]
+        return agent
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        write_lock = asyncio.Lock()
+        pending = set()
+
+        async def respond(payload: Dict):
+            async with write_lock:
+                writer.write((json.dumps(payload) + "\n").encode())
+                await writer.drain()
+
+        async def handle(request: Dict):
+            try:
+                payload = await self.dispatch(request)
+            except Busy as e:
+                payload = {'error': str(e), 'busy': True}
+            except Exception as e:
+                payload = {'error': str(e)}
+            if 'id' in request:
+                payload['id'] = request['id']
+            await respond(payload)
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await respond({'error': f"request larger than {MAX_LINE_BYTES} bytes"})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as e:
+                    await respond({'error': f"invalid request: {e}"})
+                    continue
+
+                # Requests on one connection may overlap; ordering is per session
+                task = asyncio.create_task(handle(request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: Dict) -> Dict:
+        op = request.get('op', 'chat')
+        loop = asyncio.get_running_loop()
+
+        if op == 'chat':
+            session_id = str(request.get('session') or 'default')
+            message = request.get('message')
+            if not isinstance(message, str) or not message.strip():
+                raise ValueError("chat needs a non-empty 'message'")
+            reply = await self.submit(session_id, message.strip())
+            return {'session': session_id, 'reply': reply}
+
+        if op == 'history':
+            session_id = str(request.get('session') or 'default')
+            limit = int(request.get('limit', 20))
+            await loop.run_in_executor(DB_EXECUTOR, LOG_WRITER.flush)
+            messages = await loop.run_in_executor(
+                DB_EXECUTOR, db.get_recent_messages, session_id, limit
+            )
+            return {'session': session_id, 'messages': [
+                {'role': m['role'], 'content': m['content'], 'created_at': m['created_at']}
+                for m in messages
+            ]}
+
+        if op == 'sessions':
+            after = request.get('after')
+            await loop.run_in_executor(DB_EXECUTOR, LOG_WRITER.flush)
+            sessions = await loop.run_in_executor(
+                DB_EXECUTOR, db.list_sessions, int(request.get('limit', 20)),
+                tuple(after) if after else None
+            )
+            return {'sessions': sessions}
+
+        if op == 'stats':
+            return {'stats': self.stats()}
+
+        raise ValueError(f"unknown op: {op}")
+
+    def stats(self) -> Dict:
+        return {
+            'turns': self.turns,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'sessions_loaded': len(self.agents),
+            'sessions_waiting': len(self.scheduled),
+            'queued_turns': sum(q.qsize() for q in self.queues.values()),
+            'workers': self.workers,
+            'router': ROUTER.stats(),
+            'plan_cache': PLAN_CACHE.stats(),
+            'db_pool': db.pool_stats(),
+            'db_cache': db.cache_stats(),
+            'db_writer': db.write_stats(),
+            'log_writer': LOG_WRITER.stats(),
+            'tracing': TRACER.stats()
+        }
+
+
+async def serve(host, port, path, workers):
+    server = DeskServer(workers=workers)
+    await server.start(host, port, path)
+
+    where = [f"{host}:{port}"] if port is not None else []
+    if path:
+        where.append(path)
+    print(f"Desk server listening on {', '.join(where)} ({server.workers} workers)")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Serve the library desk agent to many terminals")
+    parser.add_argument("--host", default=DESK_HOST)
+    parser.add_argument("--port", type=int, default=DESK_PORT)
+    parser.add_argument("--socket", default=DESK_SOCKET, help="also listen on this Unix socket")
+    parser.add_argument("--no-tcp", action="store_true", help="only listen on --socket")
+    parser.add_argument("--workers", type=int, default=DESK_WORKERS)
+    args = parser.parse_args()
+
+    if args.no_tcp and not args.socket:
+        parser.error("--no-tcp needs --socket")
+    if not os.getenv("GROQ_API_KEY"):
+        print("GROQ_API_KEY not found! Add it to .env file")
+        return
+
+    db.init_database()
+    try:
+        asyncio.run(serve(args.host, None if args.no_tcp else args.port, args.socket, args.workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        LOG_WRITER.close()
+
+
+if __name__ == "__main__":
+    main()
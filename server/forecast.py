@@ -0,0 +1,171 @@
+"""
+Vectorized reorder forecasting from order history
+"""
+
+import os
+import json
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+import numpy as np
+from database import db
+
+
+# Days of history the moving average covers
+FORECAST_WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", "28"))
+# Days between placing a supplier order and the copies arriving
+FORECAST_LEAD_DAYS = int(os.getenv("FORECAST_LEAD_DAYS", "7"))
+# Days of demand a reorder should cover once it arrives
+FORECAST_COVER_DAYS = int(os.getenv("FORECAST_COVER_DAYS", "30"))
+# Safety stock in standard deviations of lead-time demand (1.65 ~ 95% service level)
+FORECAST_SERVICE_Z = float(os.getenv("FORECAST_SERVICE_Z", "1.65"))
+
+FETCH_SIZE = 50000
+
+
+def _stream_columns(cursor, columns: int, dtype=np.float64) -> np.ndarray:
+    """Read the cursor in fetchmany chunks into one (rows, columns) array"""
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=dtype))
+    if not chunks:
+        return np.empty((0, columns), dtype=dtype)
+    return np.concatenate(chunks)
+
+
+def demand_forecast(window_days: int = FORECAST_WINDOW_DAYS, lead_days: int = FORECAST_LEAD_DAYS,
+                    cover_days: int = FORECAST_COVER_DAYS, z: float = FORECAST_SERVICE_Z,
+                    database=None) -> Dict:
+    """Per-book demand statistics over the last window_days, as arrays.
+
+    One streaming pass over order lines in the window; everything after
+    that is array arithmetic. Returns rowid, stock, avg_daily, std_daily,
+    days_of_cover, reorder_point and reorder_qty arrays aligned by book.
+    """
+    database = database or db
+    window_days = max(1, window_days)
+    today = datetime.now(timezone.utc).date()
+    since = (today - timedelta(days=window_days - 1)).isoformat()
+
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        # Plain tuples; sqlite3.Row is much slower to turn into arrays
+        cursor.row_factory = None
+        # One read snapshot for both passes, so every order line has its book
+        cursor.execute("BEGIN")
+
+        cursor.execute("SELECT rowid, stock FROM books ORDER BY rowid")
+        books = _stream_columns(cursor, 2, np.int64)
+
+        # CROSS JOIN pins the plan to a range scan of idx_orders_created
+        # followed by the covering order_items index, instead of a full scan
+        # of order_items
+        cursor.execute("""
+            SELECT b.rowid,
+                   CAST(julianday(?) - julianday(date(o.created_at)) AS INTEGER),
+                   oi.quantity
+            FROM orders o
+            CROSS JOIN order_items oi ON oi.order_id = o.id
+            JOIN books b ON b.isbn = oi.isbn
+            WHERE o.created_at >= ?
+        """, (today.isoformat(), since))
+        lines = _stream_columns(cursor, 3, np.int64)
+        conn.rollback()
+
+    rowid, stock = books[:, 0], books[:, 1].astype(np.float64)
+    n = len(rowid)
+
+    # Map each line to its book's position and its day within the window
+    in_window = (lines[:, 1] >= 0) & (lines[:, 1] < window_days)
+    lines = lines[in_window]
+    book = np.searchsorted(rowid, lines[:, 0])
+    day = lines[:, 1]
+    qty = lines[:, 2].astype(np.float64)
+
+    # Units per (book, day), then per-book mean and variance of daily demand
+    cell, daily = np.unique(book * window_days + day, return_inverse=True)
+    per_day = np.bincount(daily, weights=qty, minlength=len(cell))
+    total = np.bincount(cell // window_days, weights=per_day, minlength=n)
+    squares = np.bincount(cell // window_days, weights=per_day ** 2, minlength=n)
+
+    avg_daily = total / window_days
+    std_daily = np.sqrt(np.maximum(squares / window_days - avg_daily ** 2, 0.0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(avg_daily > 0, stock / avg_daily, np.inf)
+
+    safety = z * std_daily * math.sqrt(lead_days)
+    reorder_point = avg_daily * lead_days + safety
+    target = avg_daily * (lead_days + cover_days) + safety
+    reorder_qty = np.where(
+        (avg_daily > 0) & (stock <= reorder_point),
+        np.ceil(np.maximum(target - stock, 0.0)),
+        0.0
+    ).astype(np.int64)
+
+    return {
+        'since': since,
+        'until': today.isoformat(),
+        'window_days': window_days,
+        'lead_days': lead_days,
+        'cover_days': cover_days,
+        'order_lines': int(len(lines)),
+        'rowid': rowid,
+        'stock': books[:, 1],
+        'sold': total,
+        'avg_daily': avg_daily,
+        'std_daily': std_daily,
+        'days_of_cover': days_of_cover,
+        'reorder_point': reorder_point,
+        'reorder_qty': reorder_qty
+    }
+
+
+def reorder_suggestions(limit: int = 20, window_days: int = FORECAST_WINDOW_DAYS,
+                        lead_days: int = FORECAST_LEAD_DAYS, cover_days: int = FORECAST_COVER_DAYS,
+                        database=None) -> Dict:
+    """Books due for a reorder, shortest days-of-cover first"""
+    database = database or db
+    f = demand_forecast(window_days, lead_days, cover_days, database=database)
+
+    due = np.flatnonzero(f['reorder_qty'] > 0)
+    due = due[np.lexsort((-f['avg_daily'][due], f['days_of_cover'][due]))][:limit]
+
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT rowid, isbn, title
+            FROM books
+            WHERE rowid IN (SELECT value FROM json_each(?))
+        """, (json.dumps(f['rowid'][due].tolist()),))
+        names = {row['rowid']: dict(row) for row in cursor.fetchall()}
+
+    items = []
+    for i in due:
+        book = names.get(int(f['rowid'][i]))
+        if book is None:
+            continue
+        items.append({
+            'isbn': book['isbn'],
+            'title': book['title'],
+            'stock': int(f['stock'][i]),
+            'sold': int(f['sold'][i]),
+            'avg_daily': round(float(f['avg_daily'][i]), 2),
+            'days_of_cover': round(float(f['days_of_cover'][i]), 1),
+            'reorder_point': round(float(f['reorder_point'][i]), 1),
+            'reorder_qty': int(f['reorder_qty'][i])
+        })
+
+    return {
+        'since': f['since'],
+        'until': f['until'],
+        'window_days': f['window_days'],
+        'lead_days': f['lead_days'],
+        'cover_days': f['cover_days'],
+        'order_lines': f['order_lines'],
+        'due': int((f['reorder_qty'] > 0).sum()),
+        'items': items
+    }
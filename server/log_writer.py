@@ -0,0 +1,130 @@
+"""
+Background, batched writer for chat messages and tool-call audit rows
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+from database import db
+
+
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+
+
+class LogWriter:
+    """Queues log rows and writes them from one thread in batched transactions.
+
+    A batch is flushed when it reaches batch_size rows or flush_interval
+    seconds after its first row, whichever comes first. Rows are written in
+    the order they were queued.
+    """
+
+    def __init__(self, database, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.database = database
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+
+    def log_message(self, session_id: str, role: str, content: Any):
+        if not isinstance(content, str):
+            content = str(content)
+        self._put(('message', (session_id, role, content)))
+
+    def log_tool_call(self, session_id: str, tool_name: str, args: Dict, result: Any,
+                      duration_ms: Optional[float] = None):
+        self._put(('tool_call', (session_id, tool_name, args, result, duration_ms)))
+
+    def _put(self, item):
+        if self._closed:
+            return
+        self._ensure_thread()
+        self._queue.put(item)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Block until everything queued so far is on disk"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        return done.wait(timeout)
+
+    def close(self):
+        """Flush and stop the writer thread"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(('stop', None))
+            self._thread.join(timeout=5.0)
+
+    def _run(self):
+        messages, tool_calls = [], []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                kind, payload = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload = 'timeout', None
+
+            if kind == 'message':
+                messages.append(payload)
+            elif kind == 'tool_call':
+                tool_calls.append(payload)
+
+            pending = len(messages) + len(tool_calls)
+            if pending and deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+            if pending and (kind in ('flush', 'stop', 'timeout') or pending >= self.batch_size):
+                self._write(messages, tool_calls)
+                messages, tool_calls = [], []
+                deadline = None
+
+            if kind == 'flush':
+                payload.set()
+            elif kind == 'stop':
+                return
+
+    def _write(self, messages, tool_calls):
+        try:
+            self.database.write_log_batch(messages, tool_calls)
+            self.written += len(messages) + len(tool_calls)
+            self.batches += 1
+        except Exception:
+            # Logging must never break a turn
+            self.failures += 1
+
+    def stats(self) -> Dict:
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'failures': self.failures
+        }
+
+
+LOG_WRITER = LogWriter(db)
+atexit.register(LOG_WRITER.close)
@@ -0,0 +1,113 @@
+"""
+Cache of tool-call plans for repeated read-only questions
+"""
+
+import os
+import re
+import copy
+from typing import Any, Dict, List, Optional, Tuple
+from cache import LRUCache, MISSING
+from tools import TOOLS
+from tool_runner import write_keys
+
+
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "512"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "3600"))
+
+FILLER_WORDS = {
+    "a", "an", "the", "please", "pls", "can", "could", "would", "you", "me",
+    "show", "give", "get", "tell", "what", "whats", "is", "are", "of", "for",
+    "us", "i", "want", "to", "need", "check", "some", "all", "any", "s"
+}
+
+# Arguments the model fills in with its own defaults; they need not appear in the message
+OPTION_ARGS = {"by", "limit"}
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def normalize_message(msg: str) -> str:
+    """Lowercase, drop punctuation and filler words"""
+    return " ".join(w for w in _words(msg) if w not in FILLER_WORDS)
+
+
+class PlanCache:
+    """Maps normalized user messages to the read-only tool plan the model produced.
+
+    A plan is only cached when every tool in it is read-only and every
+    argument value is spelled out in the message itself, so the plan does not
+    depend on earlier turns. Plans are re-run against the database on a hit,
+    so results are always fresh; a write to a book drops the plans that
+    mention it so the model re-plans from the new state.
+    """
+
+    def __init__(self, maxsize: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL):
+        self._cache = LRUCache(maxsize, ttl)
+        self.stores = 0
+        self.invalidations = 0
+
+    def lookup(self, msg: str) -> Optional[List[Tuple[str, Dict[str, Any]]]]:
+        plan = self._cache.get(normalize_message(msg))
+        if plan is MISSING:
+            return None
+        return copy.deepcopy(plan)
+
+    def store(self, msg: str, plan: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        key = normalize_message(msg)
+        if not key or not plan or not self._cacheable(key, plan):
+            return False
+
+        tags = set()
+        for _, args in plan:
+            for name, value in args.items():
+                if name not in OPTION_ARGS and isinstance(value, str):
+                    tags.update(w for w in _words(value) if w not in FILLER_WORDS)
+
+        self._cache.set(key, copy.deepcopy(plan), tags=tags)
+        self.stores += 1
+        return True
+
+    @staticmethod
+    def _cacheable(key: str, plan) -> bool:
+        message_words = set(key.split())
+
+        for tool_name, args in plan:
+            if tool_name not in TOOLS or not TOOLS[tool_name]['read_only'] or not isinstance(args, dict):
+                return False
+
+            for name, value in args.items():
+                if name in OPTION_ARGS:
+                    continue
+                if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    return False
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                words = [w for w in _words(str(value)) if w not in FILLER_WORDS]
+                if not words or not set(words) <= message_words:
+                    return False
+
+        return True
+
+    def invalidate_writes(self, calls: List[Tuple[str, Dict[str, Any]]]):
+        """Drop cached plans that mention a book touched by a mutating call"""
+        for tool_name, args in calls:
+            if tool_name not in TOOLS or TOOLS[tool_name]['read_only'] or not isinstance(args, dict):
+                continue
+            for ref in write_keys(tool_name, args):
+                for word in _words(ref):
+                    if word not in FILLER_WORDS:
+                        self.invalidations += self._cache.invalidate_tag(word)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict:
+        stats = self._cache.stats()
+        stats['stores'] = self.stores
+        stats['invalidations'] = self.invalidations
+        return stats
+
+
+PLAN_CACHE = PlanCache()
@@ -0,0 +1,184 @@
+"""
+Rule-based fast path for unambiguous desk commands
+"""
+
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+Plan = List[Tuple[str, Dict[str, Any]]]
+
+BOOK = r"[\"']?(?P<book>[^\"']+?)[\"']?"
+NUMBER = r"\$?(?P<num>\d+(?:\.\d+)?)"
+
+
+# A book capture starting with one of these refers to context or is filler
+# ("restock it by 5", "show me python books") - the model resolves those
+PRONOUNS = {"it", "this", "that", "them", "these", "those", "they", "one"}
+FILLER = {"me", "us", "the", "a", "an", "all", "some", "any", "my", "our", "every"}
+# Words that describe a listing rather than name a book ("books by price")
+DESCRIPTORS = {
+    "price", "prices", "priced", "cost", "stock", "stocked", "low", "high", "top", "selling",
+    "best", "bestselling", "bestsellers", "popular", "cheap", "cheapest", "expensive",
+    "new", "newest", "latest", "recent", "sales", "sold", "unsold", "more", "most", "less",
+    "least", "fast", "slow", "moving", "available", "inventory"
+}
+
+
+def _book(m) -> Optional[str]:
+    """The captured book reference, or None if it is not a concrete title"""
+    book = m.group("book").strip()
+    words = re.findall(r"[\w'-]+", book.lower())
+    if not words or words[0] in PRONOUNS | FILLER or DESCRIPTORS.intersection(words):
+        return None
+    return book
+
+
+def _restock(m):
+    book = _book(m)
+    if book is None:
+        return None
+    return [("restock_book", {"isbn": book, "qty": int(m.group("num"))})]
+
+
+def _update_price(m):
+    book = _book(m)
+    if book is None:
+        return None
+    return [("update_price", {"isbn": book, "price": float(m.group("num"))})]
+
+
+def _order_status(m):
+    return [("order_status", {"order_id": int(m.group("num"))})]
+
+
+def _inventory(m):
+    return [("inventory_summary", {})]
+
+
+def _sales_report(m):
+    by = "author" if (m.group("group") or "").lower().startswith("author") else "title"
+    return [("sales_report", {"by": by})]
+
+
+def _find_title(m):
+    book = _book(m)
+    if book is None:
+        return None
+    return [("find_books", {"q": book, "by": "title"})]
+
+
+def _find_author(m):
+    book = _book(m)
+    if book is None:
+        return None
+    return [("find_books", {"q": book, "by": "author"})]
+
+
+def _sell(m):
+    book = _book(m)
+    if book is None:
+        return None
+    return [("create_order", {
+        "customer_id": int(m.group("customer")),
+        "items": [{"isbn": book, "qty": int(m.group("num"))}]
+    })]
+
+
+# Each pattern must match the whole message (case-insensitive). A rule whose
+# builder returns None does not apply, e.g. when the book is "it"
+RULES = [
+    (rf"(?:restock|add stock to)\s+{BOOK}\s+(?:by|with)\s+(?P<num>\d+)(?:\s+(?:copies|units))?", _restock),
+    (rf"add\s+(?P<num>\d+)\s+(?:copies|units)\s+(?:of|to)\s+{BOOK}", _restock),
+    (rf"(?:update|change|set)\s+(?:the\s+)?(?:price|salary|cost)\s+(?:of\s+|for\s+)?{BOOK}\s+(?:to\s+)?{NUMBER}", _update_price),
+    (r"(?:what(?:'s|\s+is)\s+)?(?:the\s+)?status\s+(?:of|for)\s+order\s+#?(?P<num>\d+)", _order_status),
+    (r"order\s+(?:status\s+(?:of\s+|for\s+)?)?#?(?P<num>\d+)(?:\s+status)?", _order_status),
+    (r"(?:show\s+)?(?:the\s+)?(?:inventory(?:\s+summary)?|stock\s+overview)", _inventory),
+    # Report phrasings come before the find rules, which would read them as titles
+    (r"(?:show\s+|list\s+)?(?:me\s+)?(?:the\s+)?(?:low[\s-]+stock|low[\s-]+on[\s-]+stock)(?:\s+(?:books|titles|items|alerts?))?", _inventory),
+    (r"(?:show\s+|list\s+)?(?:me\s+)?(?:the\s+)?(?:(?:top|best)[\s-]*sell(?:ing|ers)|bestsell(?:ing|ers))(?:\s+(?P<group>books|titles|authors))?", _sales_report),
+    (rf"(?:find|search(?:\s+for)?|show)\s+(?:all\s+)?books\s+by\s+{BOOK}", _find_author),
+    (rf"(?:find|search(?:\s+for)?|show)\s+(?:all\s+)?{BOOK}\s+books", _find_title),
+    (rf"(?:find|search(?:\s+for)?)\s+books\s+(?:about|on|titled|called)\s+{BOOK}", _find_title),
+    (rf"sell\s+(?P<num>\d+)\s+(?:copies\s+of\s+)?{BOOK}\s+to\s+customer\s+#?(?P<customer>\d+)", _sell),
+]
+
+# Anything that hints at more than one request goes to the model
+COMPOUND = re.compile(r"\b(?:and|then|also|after|before|but)\b|[;,\n]", re.IGNORECASE)
+
+
+class IntentRouter:
+    """Parses high-confidence commands straight into tool calls.
+
+    Returns None whenever a message is not an exact match for one rule, or
+    names its book vaguely (a pronoun, "me", "all", "by price"), so the
+    caller can fall back to the model.
+    """
+
+    def __init__(self, rules=RULES):
+        self.rules = [(re.compile(pattern, re.IGNORECASE), build) for pattern, build in rules]
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.route_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    def route(self, msg: str) -> Optional[Plan]:
+        start = time.perf_counter()
+        plan = self._match(msg)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.route_seconds += elapsed
+            if plan is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return plan
+
+    def _match(self, msg: str) -> Optional[Plan]:
+        text = msg.strip().rstrip(".!?").strip()
+        if not text or COMPOUND.search(text):
+            return None
+
+        matches = []
+        for pattern, build in self.rules:
+            m = pattern.fullmatch(text)
+            if m:
+                plan = build(m)
+                if plan is not None:
+                    matches.append(plan)
+
+        if not matches:
+            return None
+
+        # Two rules reading the message differently means it is ambiguous
+        if any(plan != matches[0] for plan in matches[1:]):
+            return None
+        return matches[0]
+
+    def record_llm_call(self, seconds: float):
+        """Feed observed model latency so the savings estimate stays realistic"""
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+
+    def stats(self) -> Dict:
+        with self._lock:
+            routed = self.hits + self.misses
+            avg_llm = self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / routed, 3) if routed else 0.0,
+                'avg_route_ms': round(self.route_seconds / routed * 1000, 3) if routed else 0.0,
+                'avg_llm_ms': round(avg_llm * 1000, 1),
+                'est_saved_s': round(self.hits * avg_llm, 2)
+            }
+
+
+ROUTER = IntentRouter()
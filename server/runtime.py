@@ -0,0 +1,75 @@
+"""
+Process-wide agent runtime: one LLM client and the system prompt, shared by every session
+"""
+
+import os
+import threading
+from pathlib import Path
+from langchain_groq import ChatGroq
+from tools import tool_schemas
+
+
+PROMPT_PATH = Path(__file__).parent.parent / "prompts" / "System_prompt.md"
+DEFAULT_PROMPT = "You are a Library Agent. Use tools when needed."
+
+
+class AgentRuntime:
+    """Holds the state that is the same for every LibraryAgent.
+
+    The ChatGroq client (and its HTTP connection pool) is built once, on
+    first use, and the tool-bound variant is derived from it once. The
+    system prompt is read from disk only when the file's mtime changes, so
+    edits still take effect without a restart.
+    """
+
+    def __init__(self, llm=None, prompt_path: Path = PROMPT_PATH):
+        self.prompt_path = Path(prompt_path)
+
+        self._lock = threading.Lock()
+        self._llm = llm
+        self._llm_tools = None
+        self._prompt = None
+        self._prompt_mtime = None
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self._llm = ChatGroq(
+                        model="llama-3.3-70b-versatile",
+                        temperature=0,
+                        groq_api_key=os.getenv("GROQ_API_KEY"),
+                        max_tokens=512
+                    )
+        return self._llm
+
+    @property
+    def llm_tools(self):
+        """The LLM with TOOLS bound for native tool calling, when the model supports it"""
+        if self._llm_tools is None:
+            llm = self.llm
+            with self._lock:
+                if self._llm_tools is None:
+                    try:
+                        self._llm_tools = llm.bind_tools(tool_schemas())
+                    except NotImplementedError:
+                        self._llm_tools = llm
+        return self._llm_tools
+
+    @property
+    def prompt(self) -> str:
+        try:
+            mtime = self.prompt_path.stat().st_mtime_ns
+        except OSError:
+            return DEFAULT_PROMPT
+
+        if mtime != self._prompt_mtime:
+            with self._lock:
+                if mtime != self._prompt_mtime:
+                    self._prompt = self.prompt_path.read_text(encoding='utf-8')
+                    self._prompt_mtime = mtime
+        return self._prompt
+
+
+RUNTIME = AgentRuntime()
@@ -0,0 +1,146 @@
+"""
+Dependency-aware execution of the tool calls in one agent reply
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Any, Optional
+from pydantic import ValidationError
+from database import db
+from tools import TOOLS, validate_args
+from tracing import TRACER, in_context
+
+
+TOOL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TOOL_WORKERS", "8")),
+    thread_name_prefix="tool"
+)
+
+
+def write_keys(tool_name: str, args: Dict[str, Any]) -> List[str]:
+    """Books (ISBN or title as given) a mutating tool call touches"""
+    if tool_name in ('create_order', 'reserve_stock'):
+        refs = [item.get('isbn', '') for item in args.get('items') or [] if isinstance(item, dict)]
+        if args.get('reservation_id'):
+            refs.append(args['reservation_id'])
+    elif tool_name == 'release_reservation':
+        refs = [args.get('reservation_id', '')]
+    else:
+        refs = [args.get('isbn', '')]
+    return [str(ref).strip().lower() for ref in refs]
+
+
+class ToolBatch:
+    """Runs a batch of tool calls and returns results in submission order.
+
+    Read-only tools run in parallel. A mutating tool waits for earlier
+    mutating calls on the same book (by ISBN, however the book was named),
+    and a read waits for every write submitted before it, so a turn always
+    sees its own writes.
+    """
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = TOOL_EXECUTOR):
+        # executor=None runs each call inline (no thread hop for a lone call)
+        self.executor = executor
+        self.runs = []
+        self._writes = []
+        self._last_write = {}
+        self._barrier = None
+
+    def submit(self, tool_name: str, args: Dict[str, Any]) -> Dict:
+        run = {'tool': tool_name, 'args': args, 'result': None, 'ms': 0.0, 'future': None}
+        self.runs.append(run)
+
+        if tool_name not in TOOLS:
+            run['result'] = f"Unknown tool: {tool_name}"
+            return run
+
+        if not isinstance(args, dict):
+            # A native call whose arguments were not valid JSON
+            run['result'] = f"Error: invalid arguments for {tool_name} (not a JSON object: {str(args)[:200]})"
+            return run
+
+        try:
+            args = run['args'] = validate_args(tool_name, args)
+        except ValidationError as e:
+            problems = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            run['result'] = f"Error: invalid arguments for {tool_name} ({problems})"
+            return run
+
+        spec = TOOLS[tool_name]
+        if self.executor is None:
+            self._run(run, spec['function'], [])
+            return run
+
+        if spec['read_only']:
+            deps = list(self._writes)
+        else:
+            isbns = self._write_isbns(tool_name, args)
+            if isbns is None:
+                # Books unknown up front: run after every earlier write
+                deps = list(self._writes)
+            else:
+                deps = [self._last_write[isbn] for isbn in isbns if isbn in self._last_write]
+                if self._barrier is not None:
+                    deps.append(self._barrier)
+
+        run['future'] = self.executor.submit(in_context(self._run), run, spec['function'], deps)
+
+        if not spec['read_only']:
+            self._writes.append(run['future'])
+            if isbns is None:
+                self._barrier = run['future']
+            else:
+                for isbn in isbns:
+                    self._last_write[isbn] = run['future']
+
+        return run
+
+    @staticmethod
+    def _write_isbns(tool_name: str, args: Dict[str, Any]) -> Optional[List[str]]:
+        """ISBNs a mutating call touches, or None when they can't be resolved
+        exactly (a reservation's books, an ambiguous or unknown title)"""
+        if tool_name == 'release_reservation' or args.get('reservation_id'):
+            return None
+        refs = list(dict.fromkeys(write_keys(tool_name, args)))
+        matches = db.resolve_books(refs)['matches']
+        if len(matches) < len(refs):
+            return None
+        return list(dict.fromkeys(book['isbn'] for book in matches.values()))
+
+    @staticmethod
+    def _run(run, func, deps):
+        # Dependencies were queued earlier on the same FIFO executor, so they
+        # are already running or done and this wait can't deadlock
+        wait(deps)
+
+        with TRACER.span(f"tool.{run['tool']}", "tool") as span:
+            start = time.perf_counter()
+            try:
+                run['result'] = func(**run['args']) if run['args'] else func()
+            except Exception as e:
+                run['result'] = f"Error: {e}"
+            run['ms'] = (time.perf_counter() - start) * 1000
+            if span is not None and str(run['result']).startswith("Error"):
+                span.set(error=True)
+        return run
+
+    @staticmethod
+    def is_done(run: Dict) -> bool:
+        return run['future'] is None or run['future'].done()
+
+    def results(self) -> List[str]:
+        """Wait for every call; results come back in submission order"""
+        for run in self.runs:
+            if run['future'] is not None:
+                run['future'].result()
+        return [run['result'] for run in self.runs]
+
+    def timings(self) -> List[Dict]:
+        return [
+            {'tool': run['tool'], 'args': run['args'], 'ms': round(run['ms'], 2)}
+            for run in self.runs
+        ]
@@ -1,41 +1,85 @@
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from database import db
+from forecast import reorder_suggestions
 
 
 
 class FindBooksInput(BaseModel):
     q: str = Field(description="Search query string")
-    by: str = Field(default="title", description="Search by 'title' or 'author'")
+    by: str = Field(default="title", description="Search by 'title', 'author' or 'any' (both)")
+    limit: int = Field(default=20, description="Maximum number of results")
+
+
+class OrderItemInput(BaseModel):
+    isbn: str = Field(description="ISBN or book title")
+    qty: int = Field(default=1, gt=0, description="Quantity")
 
 
 class CreateOrderInput(BaseModel):
     customer_id: int = Field(description="Customer ID")
-    items: List[Dict[str, Any]] = Field(description="List of items with 'isbn' and 'qty' keys")
+    items: List[OrderItemInput] = Field(description="List of items with 'isbn' and 'qty' keys")
+    reservation_id: Optional[str] = Field(default=None, description="Reservation to fill, from reserve_stock")
+
+
+class ReserveStockInput(BaseModel):
+    items: List[OrderItemInput] = Field(description="List of items with 'isbn' and 'qty' keys")
+
+
+class ReleaseReservationInput(BaseModel):
+    reservation_id: str = Field(description="Reservation ID from reserve_stock")
 
 
 class RestockBookInput(BaseModel):
     isbn: str = Field(description="ISBN or book title to search for")
-    qty: int = Field(description="Quantity to add to stock")
+    qty: int = Field(gt=0, description="Quantity to add to stock")
 
 
 class UpdatePriceInput(BaseModel):
     isbn: str = Field(description="ISBN or book title to search for")
-    price: float = Field(description="New price")
+    price: float = Field(ge=0, description="New price")
 
 
 class OrderStatusInput(BaseModel):
     order_id: int = Field(description="Order ID to check")
 
 
-def find_books(q: str, by: str = "title") -> str:
+class ReorderForecastInput(BaseModel):
+    window_days: int = Field(default=28, description="Days of sales history to average demand over")
+    lead_days: int = Field(default=7, description="Supplier lead time in days")
+    cover_days: int = Field(default=30, description="Days of demand a reorder should cover")
+    limit: int = Field(default=20, description="Maximum number of books to list")
+
+
+class ReportPeriodInput(BaseModel):
+    days: int = Field(default=30, description="Look back this many days, ending today (ignored if start is set)")
+    start: Optional[str] = Field(default=None, description="First day, YYYY-MM-DD")
+    end: Optional[str] = Field(default=None, description="Last day, YYYY-MM-DD (default today)")
+    limit: int = Field(default=10, description="Number of rows to return")
+
+
+class SalesReportInput(ReportPeriodInput):
+    by: str = Field(default="title", description="Group by 'title' or 'author'")
+    sort: str = Field(default="quantity", description="Rank by 'quantity' (units) or 'revenue'")
+
+
+class StockTurnoverInput(ReportPeriodInput):
+    slowest: bool = Field(default=False, description="List slow movers first instead of fast movers (full catalogue scan)")
+
+
+def find_books(q: str, by: str = "title", limit: int = 20) -> str:
     try:
-        books = db.find_books(q, by)
+        books = db.find_books(q, by, limit=limit)
         
         if not books:
             return f"No books found matching '{q}' in {by}."
         
-        result = f"Found {len(books)} book(s):\n\n"
+        if len(books) == limit:
+            result = f"Showing top {limit} matches:\n\n"
+        else:
+            result = f"Found {len(books)} book(s):\n\n"
         for book in books:
             result += f" {book['title']}\n"
             result += f"   Author: {book['author']}\n"
@@ -48,31 +92,60 @@ def find_books(q: str, by: str = "title") -> str:
         return f"Error: {str(e)}"
 
 
-def create_order(customer_id: int, items: List[Dict[str, Any]]) -> str:
+def _ambiguity(resolved: Dict, detail=None) -> str:
+    """Candidates for each ambiguous ref, capped by resolve_books"""
+    result = ""
+    for ref, books in resolved['ambiguous'].items():
+        result += f"Multiple books found for '{ref}'. Please specify:\n\n"
+        for b in books:
+            result += f"  • {b['title']} (ISBN: {b['isbn']}){detail(b) if detail else ''}\n"
+        more = resolved['more'].get(ref)
+        if more:
+            result += f"  ... and {more} more - give the ISBN or more of the title\n"
+        result += "\n"
+    return result.strip()
+
+
+def _resolve_items(items: List[Dict[str, Any]]):
+    """Map each item's title/ISBN to one book. Returns (items, error message or None)"""
+    # Resolve every title/ISBN in one lookup
+    resolved = db.resolve_books([item.get('isbn', '') for item in items])
+    
+    if resolved['missing']:
+        missing = ", ".join(f"'{ref}'" for ref in resolved['missing'])
+        return None, f"Error: No book found matching {missing}."
+    
+    if resolved['ambiguous']:
+        return None, _ambiguity(resolved)
+    
+    return [
+        {'isbn': resolved['matches'][item.get('isbn', '')]['isbn'], 'qty': item.get('qty', 1)}
+        for item in items
+    ], None
+
+
+def _resolve_book(ref: str, detail=None):
+    """One title/ISBN to one book, as create_order does. Returns (book, error message or None)"""
+    resolved = db.resolve_books([ref])
+    if ref in resolved['matches']:
+        return resolved['matches'][ref], None
+    if resolved['ambiguous']:
+        return None, _ambiguity(resolved, detail)
+    return None, f"Error: No book found matching '{ref}'."
+
+
+def create_order(customer_id: int, items: List[Dict[str, Any]],
+                 reservation_id: Optional[str] = None) -> str:
     try:
         customer = db.get_customer(customer_id)
         if not customer:
             return f"Error: Customer ID {customer_id} not found."
         
-        processed_items = []
-        for item in items:
-            isbn = item.get('isbn', '')
-            qty = item.get('qty', 1)
-            
-            if not isbn.startswith('978'):
-                books = db.find_books(isbn, "title")
-                if not books:
-                    return f"Error: No book found matching '{isbn}'."
-                if len(books) > 1:
-                    result = f"Multiple books found for '{isbn}'. Please specify:\n\n"
-                    for b in books:
-                        result += f"  • {b['title']} (ISBN: {b['isbn']})\n"
-                    return result.strip()
-                isbn = books[0]['isbn']
-            
-            processed_items.append({'isbn': isbn, 'qty': qty})
-        
-        result = db.create_order(customer_id, processed_items)
+        processed_items, error = _resolve_items(items)
+        if error:
+            return error
+        
+        result = db.create_order(customer_id, processed_items, reservation_id=reservation_id)
         
         output = f" Order #{result['order_id']} created!\n\n"
         output += f"Customer: {customer['name']} ({customer['email']})\n"
@@ -91,30 +164,47 @@ def create_order(customer_id: int, items: List[Dict[str, Any]]) -> str:
         return f"Error: {str(e)}"
 
 
+def reserve_stock(items: List[Dict[str, Any]]) -> str:
+    """Hold copies while an order is being put together"""
+    try:
+        processed_items, error = _resolve_items(items)
+        if error:
+            return error
+        
+        result = db.reserve_stock(processed_items)
+        minutes = max(1, round((result['expires_at'] - time.time()) / 60))
+        
+        output = f" Reservation {result['reservation_id']} (held for {minutes} min)\n\n"
+        for item in result['items']:
+            output += f"  • {item['title']} - Qty: {item['quantity']}\n"
+        output += "\nPass reservation_id to create_order to complete it."
+        
+        return output
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def release_reservation(reservation_id: str) -> str:
+    """Give reserved copies back to stock"""
+    try:
+        if db.release_reservation(reservation_id):
+            return f" Reservation {reservation_id} released."
+        return f"Error: Reservation {reservation_id} not found or expired."
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
 def restock_book(isbn: str, qty: int) -> str:
     """Restock a book"""
     try:
-        book = db.get_book(isbn)
-        if not book:
-            if not isbn.startswith('978'):
-                books = db.find_books(isbn, "title")
-                if books:
-                    if len(books) == 1:
-                        book = books[0]
-                        isbn = book['isbn']
-                    else:
-                        # Multiple matches - show options
-                        result = f"Found {len(books)} books matching '{isbn}'. Please specify:\n\n"
-                        for b in books:
-                            result += f"  • {b['title']} (ISBN: {b['isbn']}) - Stock: {b['stock']}\n"
-                        return result.strip()
-                else:
-                    return f"Error: No book found matching '{isbn}'."
-            else:
-                return f"Error: Book with ISBN {isbn} not found."
+        book, error = _resolve_book(isbn, lambda b: f" - Stock: {b['stock']}")
+        if error:
+            return error
+        isbn = book['isbn']
         
         old_stock = book['stock']
-        db.update_stock(isbn, qty)
+        if not db.update_stock(isbn, qty):
+            return f"Error: Cannot change stock of {book['title']} by {qty} (current stock: {old_stock})."
         book = db.get_book(isbn)
         
         output = f" Restocked: {book['title']}\n"
@@ -129,26 +219,10 @@ def restock_book(isbn: str, qty: int) -> str:
 
 def update_price(isbn: str, price: float) -> str:
     try:
-        # First try direct ISBN lookup
-        book = db.get_book(isbn)
-        
-        if not book:
-            if not isbn.startswith('978'):
-                books = db.find_books(isbn, "title")
-                if books:
-                    if len(books) == 1:
-                        book = books[0]
-                        isbn = book['isbn']
-                    else:
-                        # Multiple matches - show options
-                        result = f"Found {len(books)} books matching '{isbn}'. Please specify:\n\n"
-                        for b in books:
-                            result += f"  • {b['title']} (ISBN: {b['isbn']}) - ${b['price']:.2f}\n"
-                        return result.strip()
-                else:
-                    return f"Error: No book found matching '{isbn}'."
-            else:
-                return f"Error: Book with ISBN {isbn} not found."
+        book, error = _resolve_book(isbn, lambda b: f" - ${b['price']:.2f}")
+        if error:
+            return error
+        isbn = book['isbn']
         
         old_price = book['price']
         db.update_price(isbn, price)
@@ -194,7 +268,7 @@ def inventory_summary() -> str:
         output += f"Total Value: ${summary['total_value']:.2f}\n\n"
         
         if summary['low_stock']:
-            output += " LOW STOCK (< 5 units):\n\n"
+            output += f" LOW STOCK (< {summary['low_stock_threshold']} units):\n\n"
             for book in summary['low_stock']:
                 output += f"  • {book['title']}\n"
                 output += f"    Stock: {book['stock']} units\n"
@@ -207,35 +281,198 @@ def inventory_summary() -> str:
         return f"Error: {str(e)}"
 
 
+def reorder_forecast(window_days: int = 28, lead_days: int = 7, cover_days: int = 30,
+                     limit: int = 20) -> str:
+    try:
+        forecast = reorder_suggestions(limit, window_days, lead_days, cover_days, database=db)
+        
+        output = " REORDER FORECAST\n\n"
+        output += f"Demand: {forecast['window_days']}-day average ({forecast['since']} to {forecast['until']}, "
+        output += f"{forecast['order_lines']} order lines)\n"
+        output += f"Lead time: {forecast['lead_days']} days, reorder covers {forecast['cover_days']} days\n\n"
+        
+        if not forecast['items']:
+            return output + " No books need reordering at current sales rates."
+        
+        output += f" REORDER NOW ({forecast['due']} book(s)):\n\n"
+        for item in forecast['items']:
+            output += f"  • {item['title']} (ISBN: {item['isbn']})\n"
+            output += f"    Stock: {item['stock']}, Selling: {item['avg_daily']}/day, "
+            output += f"Cover: {item['days_of_cover']} days\n"
+            output += f"    Suggested order: {item['reorder_qty']} units\n\n"
+        
+        return output.strip()
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def _period(report: Dict) -> str:
+    return f"{report['start']} to {report['end']}"
+
+
+def sales_report(days: int = 30, start: Optional[str] = None, end: Optional[str] = None,
+                 limit: int = 10, by: str = "title", sort: str = "quantity") -> str:
+    try:
+        report = db.sales_report(start, end, days, by=by, sort=sort, limit=limit)
+        
+        if not report['rows']:
+            return f"No sales from {_period(report)}."
+        
+        output = f" TOP SELLERS BY {report['by'].upper()} ({_period(report)}, by {report['sort']})\n\n"
+        for i, row in enumerate(report['rows'], 1):
+            if report['by'] == 'author':
+                output += f"  {i}. {row['author']} ({row['titles']} title(s))\n"
+            else:
+                output += f"  {i}. {row['title']} by {row['author']} (ISBN: {row['isbn']})\n"
+            output += f"     Sold: {row['quantity']} units in {row['order_lines']} order line(s), "
+            output += f"Revenue: ${row['revenue']:.2f}\n"
+        
+        return output.strip()
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def customer_revenue(days: int = 30, start: Optional[str] = None, end: Optional[str] = None,
+                     limit: int = 10) -> str:
+    try:
+        report = db.revenue_by_customer(start, end, days, limit=limit)
+        
+        if not report['rows']:
+            return f"No orders from {_period(report)}."
+        
+        output = f" REVENUE BY CUSTOMER ({_period(report)})\n\n"
+        for i, row in enumerate(report['rows'], 1):
+            output += f"  {i}. {row['name']} (ID {row['customer_id']})\n"
+            output += f"     Orders: {row['orders']}, Revenue: ${row['revenue']:.2f}, "
+            output += f"Last order: {row['last_order']}\n"
+        
+        return output.strip()
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def stock_turnover(days: int = 30, start: Optional[str] = None, end: Optional[str] = None,
+                   limit: int = 10, slowest: bool = False) -> str:
+    try:
+        report = db.stock_turnover(start, end, days, slowest=slowest, limit=limit)
+        
+        if not report['rows']:
+            return "No books in the catalogue."
+        
+        kind = "SLOWEST" if report['slowest'] else "FASTEST"
+        output = f" {kind} MOVING BOOKS ({_period(report)})\n\n"
+        for i, row in enumerate(report['rows'], 1):
+            cover = f"{row['days_of_cover']} days" if row['days_of_cover'] is not None else "no sales"
+            output += f"  {i}. {row['title']} (ISBN: {row['isbn']})\n"
+            output += f"     Sold: {row['sold']}, In stock: {row['stock']}, "
+            output += f"Turnover: {row['turnover']}, Cover: {cover}\n"
+        
+        return output.strip()
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
 TOOLS = {
     'find_books': {
         'function': find_books,
         'description': 'Search for books by title or author',
-        'parameters': FindBooksInput
+        'parameters': FindBooksInput,
+        'read_only': True
     },
     'create_order': {
         'function': create_order,
         'description': 'Create order and reduce stock',
-        'parameters': CreateOrderInput
+        'parameters': CreateOrderInput,
+        'read_only': False
+    },
+    'reserve_stock': {
+        'function': reserve_stock,
+        'description': 'Hold stock for an order in progress; returns a reservation ID for create_order',
+        'parameters': ReserveStockInput,
+        'read_only': False
+    },
+    'release_reservation': {
+        'function': release_reservation,
+        'description': 'Release a stock reservation that will not be ordered',
+        'parameters': ReleaseReservationInput,
+        'read_only': False
     },
     'restock_book': {
         'function': restock_book,
         'description': 'Add quantity to book stock',
-        'parameters': RestockBookInput
+        'parameters': RestockBookInput,
+        'read_only': False
     },
     'update_price': {
         'function': update_price,
         'description': 'Update book price',
-        'parameters': UpdatePriceInput
+        'parameters': UpdatePriceInput,
+        'read_only': False
     },
     'order_status': {
         'function': order_status,
         'description': 'Get order details',
-        'parameters': OrderStatusInput
+        'parameters': OrderStatusInput,
+        'read_only': True
     },
     'inventory_summary': {
         'function': inventory_summary,
         'description': 'Get inventory summary with low stock alerts',
-        'parameters': None
+        'parameters': None,
+        'read_only': True
+    },
+    'reorder_forecast': {
+        'function': reorder_forecast,
+        'description': 'Books to reorder based on sales velocity, with days of cover and suggested quantities',
+        'parameters': ReorderForecastInput,
+        'read_only': True
+    },
+    'sales_report': {
+        'function': sales_report,
+        'description': 'Top-selling books or authors over a date range',
+        'parameters': SalesReportInput,
+        'read_only': True
+    },
+    'customer_revenue': {
+        'function': customer_revenue,
+        'description': 'Orders and revenue per customer over a date range',
+        'parameters': ReportPeriodInput,
+        'read_only': True
+    },
+    'stock_turnover': {
+        'function': stock_turnover,
+        'description': 'Units sold vs stock held per book (fast or slow movers) over a date range; slow movers scan the whole catalogue, so they are slower',
+        'parameters': StockTurnoverInput,
+        'read_only': True
     }
-}
\ No newline at end of file
+}
+
+
+def tool_schemas() -> List[Dict[str, Any]]:
+    """TOOLS as function schemas for native tool calling"""
+    schemas = []
+    for name, spec in TOOLS.items():
+        model = spec['parameters']
+        if model is None:
+            parameters = {"type": "object", "properties": {}}
+        else:
+            # Inlines nested models ($defs) into a flat JSON schema
+            parameters = convert_to_openai_tool(model)['function']['parameters']
+        
+        schemas.append({
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": spec['description'],
+                "parameters": parameters
+            }
+        })
+    return schemas
+
+
+def validate_args(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Check and coerce tool arguments through the tool's pydantic model"""
+    model = TOOLS[tool_name]['parameters']
+    if model is None:
+        return {}
+    return model(**args).model_dump()
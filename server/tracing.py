@@ -0,0 +1,456 @@
+"""
+Per-turn tracing: spans for agent turns, model calls, tools, Database methods and SQL
+"""
+
+import os
+import json
+import time
+import sqlite3
+import inspect
+import itertools
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+# Set TRACING=0 to turn every hook into a no-op
+TRACING = os.getenv("TRACING", "1") != "0"
+# Finished traces are appended here as JSON lines when set
+TRACE_FILE = os.getenv("TRACE_FILE")
+# Recent durations kept per span name for the percentiles in stats()
+TRACE_SAMPLES = int(os.getenv("TRACE_SAMPLES", "1000"))
+# SQL statements recorded per span; the rest are only counted
+TRACE_SQL_LIMIT = int(os.getenv("TRACE_SQL_LIMIT", "200"))
+
+SQL_TEXT_CHARS = 160
+
+_current = contextvars.ContextVar("trace_span", default=None)
+_ids = itertools.count(1)
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, -(-len(ordered) * q // 100) - 1))]
+
+
+def _sql_text(sql: str) -> str:
+    return " ".join(sql.split())[:SQL_TEXT_CHARS]
+
+
+class Span:
+    """One timed operation inside a trace; children point at it via parent_id"""
+
+    __slots__ = ('name', 'kind', 'trace', 'span_id', 'parent_id', 'start', 'duration_ms',
+                 'attrs', 'sql', 'sql_dropped')
+
+    def __init__(self, name: str, kind: str, trace: 'Trace', parent_id: Optional[int], attrs: Dict):
+        self.name = name
+        self.kind = kind
+        self.trace = trace
+        self.span_id = next(_ids)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.sql = []
+        self.sql_dropped = 0
+        self.duration_ms = None
+        self.start = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add_sql(self, sql: str, ms: float, rows: int) -> Optional[list]:
+        if len(self.sql) >= TRACE_SQL_LIMIT:
+            self.sql_dropped += 1
+            return None
+        entry = [sql, ms, max(rows, 0)]
+        self.sql.append(entry)
+        return entry
+
+    def finish(self):
+        """End an open_span() span (span() and trace() finish their own)"""
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self.start) * 1000
+            self.trace.spans.append(self)
+
+    def to_dict(self, origin: float) -> Dict:
+        span = {
+            'id': self.span_id,
+            'parent': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'offset_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round(self.duration_ms or 0.0, 3)
+        }
+        if self.attrs:
+            span['attrs'] = self.attrs
+        if self.sql:
+            span['sql'] = [[_sql_text(sql), round(ms, 3), rows] for sql, ms, rows in self.sql]
+        if self.sql_dropped:
+            span['sql_dropped'] = self.sql_dropped
+        return span
+
+
+class Trace:
+    __slots__ = ('trace_id', 'started_at', 'spans')
+
+    def __init__(self):
+        self.trace_id = next(_ids)
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        # Spans append themselves as they finish; the root finishes last
+        self.spans = []
+
+
+class Tracer:
+    """Collects traces and keeps running per-span and per-statement totals.
+
+    A trace starts at trace() - one agent turn - and every span opened
+    while it is current (in this thread, or in work handed off with
+    in_context) becomes part of it. Outside a trace, span() and the
+    instrumented methods cost one context-variable lookup.
+    """
+
+    def __init__(self, enabled: bool = TRACING, path: Optional[str] = TRACE_FILE,
+                 samples: int = TRACE_SAMPLES):
+        self.enabled = enabled
+        self.path = path
+        self.samples = samples
+
+        self._lock = threading.Lock()
+        self._file = None
+        self.traces = 0
+        self.export_errors = 0
+        self._spans = {}
+        self._durations = {}
+        self._sql = {}
+        self._llm = {'calls': 0, 'ms': 0.0, 'input_tokens': 0, 'output_tokens': 0}
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current.get()
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Root span for one turn; nested inside another trace it is just a span"""
+        if not self.enabled:
+            yield None
+            return
+        if _current.get() is not None:
+            with self.span(name, "turn", **attrs) as span:
+                yield span
+            return
+
+        trace = Trace()
+        root = Span(name, "turn", trace, None, attrs)
+        token = _current.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.attrs['error'] = type(e).__name__
+            raise
+        finally:
+            _reset(token)
+            root.finish()
+            self._record(trace, root)
+
+    def trace_steps(self, name: str, steps: Iterator, **attrs) -> Iterator:
+        """trace() for a generator: steps runs in a context of its own, so the
+        trace is current only while it executes, never across a yield"""
+        if not self.enabled:
+            return (yield from steps)
+
+        parent = _current.get()
+        trace = parent.trace if parent is not None else Trace()
+        root = Span(name, "turn", trace, parent.span_id if parent is not None else None, attrs)
+        context = contextvars.copy_context()
+        context.run(_current.set, root)
+        try:
+            while True:
+                try:
+                    item = context.run(next, steps)
+                except StopIteration as stop:
+                    return stop.value
+                yield item
+        except Exception as e:
+            root.attrs['error'] = type(e).__name__
+            raise
+        finally:
+            context.run(steps.close)
+            root.finish()
+            if parent is None:
+                self._record(trace, root)
+
+    def open_span(self, name: str, kind: str = "internal", **attrs) -> Optional[Span]:
+        """Start a child of the current span without making it current; call finish()"""
+        parent = _current.get()
+        if parent is None:
+            return None
+        return Span(name, kind, parent.trace, parent.span_id, attrs)
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attrs):
+        """Child span of the current one; yields None when no trace is active"""
+        span = self.open_span(name, kind, **attrs)
+        if span is None:
+            yield None
+            return
+
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs['error'] = type(e).__name__
+            raise
+        finally:
+            _reset(token)
+            span.finish()
+
+    def _record(self, trace: Trace, root: Span):
+        with self._lock:
+            self.traces += 1
+            for span in trace.spans:
+                totals = self._spans.get(span.name)
+                if totals is None:
+                    totals = self._spans[span.name] = [0, 0.0, 0.0]
+                    self._durations[span.name] = deque(maxlen=self.samples)
+                totals[0] += 1
+                totals[1] += span.duration_ms
+                totals[2] = max(totals[2], span.duration_ms)
+                self._durations[span.name].append(span.duration_ms)
+
+                if span.kind == "llm":
+                    self._llm['calls'] += 1
+                    self._llm['ms'] += span.duration_ms
+                    self._llm['input_tokens'] += span.attrs.get('input_tokens', 0)
+                    self._llm['output_tokens'] += span.attrs.get('output_tokens', 0)
+
+                for sql, ms, rows in span.sql:
+                    stat = self._sql.get(sql)
+                    if stat is None:
+                        stat = self._sql[sql] = [0, 0.0, 0, 0.0]
+                    stat[0] += 1
+                    stat[1] += ms
+                    stat[2] += rows
+                    stat[3] = max(stat[3], ms)
+
+            if self.path:
+                self._export(trace, root)
+
+    def _export(self, trace: Trace, root: Span):
+        record = {
+            'trace_id': trace.trace_id,
+            'name': root.name,
+            'started_at': trace.started_at,
+            'duration_ms': round(root.duration_ms, 3),
+            'attrs': root.attrs,
+            'spans': [span.to_dict(root.start) for span in sorted(trace.spans, key=lambda s: s.start)]
+        }
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+        except OSError:
+            self.export_errors += 1
+
+    def export_to(self, path: Optional[str]):
+        """Start (or, with None, stop) appending finished traces to a JSONL file"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+
+    def reset(self):
+        with self._lock:
+            self.traces = 0
+            self._spans.clear()
+            self._durations.clear()
+            self._sql.clear()
+            self._llm = {'calls': 0, 'ms': 0.0, 'input_tokens': 0, 'output_tokens': 0}
+
+    def stats(self, top_sql: int = 10) -> Dict:
+        """Per-span latency and the most expensive SQL statements since start (or reset)"""
+        with self._lock:
+            spans = {}
+            for name, (count, total, longest) in self._spans.items():
+                ordered = sorted(self._durations[name])
+                spans[name] = {
+                    'count': count,
+                    'avg_ms': round(total / count, 3),
+                    'p50_ms': round(_percentile(ordered, 50), 3),
+                    'p95_ms': round(_percentile(ordered, 95), 3),
+                    'max_ms': round(longest, 3),
+                    'total_ms': round(total, 1)
+                }
+            sql = [
+                {'sql': _sql_text(text), 'count': count, 'total_ms': round(total, 2),
+                 'avg_ms': round(total / count, 3), 'max_ms': round(longest, 3), 'rows': rows}
+                for text, (count, total, rows, longest) in self._sql.items()
+            ]
+            sql.sort(key=lambda s: s['total_ms'], reverse=True)
+            llm = dict(self._llm)
+
+        llm['avg_ms'] = round(llm.pop('ms') / llm['calls'], 1) if llm['calls'] else 0.0
+        return {'traces': self.traces, 'spans': spans, 'sql': sql[:top_sql], 'llm': llm,
+                'enabled': self.enabled, 'export': self.path}
+
+    def format_stats(self, top_sql: int = 5) -> str:
+        stats = self.stats(top_sql)
+        if not stats['traces']:
+            return "No traced turns yet." if self.enabled else "Tracing is off (TRACING=0)."
+
+        lines = [f"{stats['traces']} traced turn(s)", "",
+                 f"  {'span':<32} {'count':>6} {'avg ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for name, s in sorted(stats['spans'].items(), key=lambda item: -item[1]['total_ms']):
+            lines.append(f"  {name:<32} {s['count']:>6} {s['avg_ms']:>9.2f} "
+                         f"{s['p95_ms']:>9.2f} {s['max_ms']:>9.2f}")
+
+        llm = stats['llm']
+        if llm['calls']:
+            lines += ["", f"  LLM: {llm['calls']} call(s), avg {llm['avg_ms']} ms, "
+                          f"{llm['input_tokens']} prompt / {llm['output_tokens']} completion tokens"]
+        if stats['sql']:
+            lines += ["", "  Slowest SQL (total time):"]
+            for s in stats['sql']:
+                lines.append(f"  {s['total_ms']:>9.1f} ms  {s['count']:>5}x  {s['rows']:>7} rows  {s['sql'][:70]}")
+        if stats['export']:
+            lines += ["", f"  Traces written to {stats['export']}"]
+        return "\n".join(lines)
+
+
+def _reset(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # A generator finished in a different context than it started in
+        pass
+
+
+TRACER = Tracer()
+
+
+def in_context(fn: Callable) -> Callable:
+    """fn bound to the caller's trace context, for handing to another thread"""
+    if _current.get() is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def record_usage(span: Optional[Span], message: Any):
+    """Copy a model reply's token counts onto its span"""
+    usage = getattr(message, 'usage_metadata', None)
+    if span is not None and usage:
+        span.set(input_tokens=usage.get('input_tokens', 0),
+                 output_tokens=usage.get('output_tokens', 0))
+
+
+def traced_methods(prefix: str, kind: str = "db", exclude=()):
+    """Class decorator: a span around every public method not in exclude"""
+    def decorate(cls):
+        for name, member in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not inspect.isfunction(member):
+                continue
+            setattr(cls, name, _traced(member, f"{prefix}.{name}", kind))
+        return cls
+    return decorate
+
+
+def _traced(fn: Callable, name: str, kind: str) -> Callable:
+    if inspect.isgeneratorfunction(fn):
+        # Time each step, so a lazily-consumed generator is charged per page
+        @functools.wraps(fn)
+        def generator(*args, **kwargs):
+            steps = fn(*args, **kwargs)
+            while True:
+                with TRACER.span(name, kind):
+                    try:
+                        item = next(steps)
+                    except StopIteration:
+                        return
+                yield item
+        return generator
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return fn(*args, **kwargs)
+        with TRACER.span(name, kind):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Records each statement's time (execute plus fetches) and row count on the current span"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._entry = None
+
+    def _run(self, method, sql, *args):
+        span = _current.get()
+        if span is None:
+            self._entry = None
+            return method(self, sql, *args)
+        start = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        finally:
+            self._entry = span.add_sql(sql, (time.perf_counter() - start) * 1000, self.rowcount)
+
+    def execute(self, sql, parameters=()):
+        return self._run(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._run(sqlite3.Cursor.executescript, sql_script)
+
+    def _fetch(self, method, *args):
+        entry = self._entry
+        if entry is None:
+            return method(self, *args)
+        start = time.perf_counter()
+        rows = method(self, *args)
+        entry[1] += (time.perf_counter() - start) * 1000
+        if isinstance(rows, list):
+            entry[2] += len(rows)
+        elif rows is not None:
+            entry[2] += 1
+        return rows
+
+    def fetchone(self):
+        return self._fetch(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(sqlite3.Cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(sqlite3.Cursor.fetchall)
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors (including the execute() shortcuts) are TracedCursor"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # Outside a traced turn these stay on the plain C cursor path
+
+    def execute(self, sql, parameters=()):
+        if _current.get() is None:
+            return sqlite3.Connection.cursor(self).execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if _current.get() is None:
+            return sqlite3.Connection.cursor(self).executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
@@ -0,0 +1,155 @@
+"""
+Single writer thread that group-commits database mutations
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict
+
+
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH", "64"))
+WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", "30"))
+
+
+class WriteQueue:
+    """Runs every write on one connection and one thread, committing in groups.
+
+    An operation is a function of a cursor. The writer takes whatever
+    operations are waiting (up to batch_size) and runs each inside its own
+    SAVEPOINT of a single BEGIN IMMEDIATE transaction, then commits once. An
+    operation that raises is rolled back to its savepoint without touching
+    the rest of the group. Callers are woken only after the commit, so a
+    returned result is durable.
+    """
+
+    def __init__(self, connect: Callable, batch_size: int = WRITE_BATCH_SIZE):
+        self.connect = connect
+        self.batch_size = max(1, batch_size)
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.ops = 0
+        self.failed_ops = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.largest_group = 0
+
+    def submit(self, op: Callable[[Any], Any]) -> Future:
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((op, future))
+        return future
+
+    def execute(self, op: Callable[[Any], Any], timeout: float = WRITE_TIMEOUT) -> Any:
+        """Run op(cursor) on the writer and return its result (or raise its error).
+
+        Raises TimeoutError only if op was still queued after timeout seconds
+        and has been withdrawn, so a timed-out write was never applied. Once
+        the writer has started op, this waits for its outcome.
+        """
+        future = self.submit(op)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise TimeoutError(
+                    f"Write not started after {timeout}s ({self._queue.qsize()} queued)"
+                ) from None
+            return future.result()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                    self._thread.start()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=WRITE_TIMEOUT)
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+
+                group = [item]
+                stop = False
+                while len(group) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    group.append(item)
+
+                self._commit(conn, group)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, group):
+        # Withdrawn by a caller that timed out; the rest can no longer be cancelled
+        group = [(op, future) for op, future in group if future.set_running_or_notify_cancel()]
+        if not group:
+            return
+
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+
+            for op, future in group:
+                cursor.execute("SAVEPOINT write_op")
+                try:
+                    outcomes.append((future, op(cursor), None))
+                    cursor.execute("RELEASE write_op")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write_op")
+                    cursor.execute("RELEASE write_op")
+                    outcomes.append((future, None, e))
+
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            self.failed_commits += 1
+            self.failed_ops += len(group)
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.largest_group = max(self.largest_group, len(group))
+        for future, result, error in outcomes:
+            self.ops += 1
+            if error is None:
+                future.set_result(result)
+            else:
+                self.failed_ops += 1
+                future.set_exception(error)
+
+    def stats(self) -> Dict:
+        return {
+            'queued': self._queue.qsize(),
+            'ops': self.ops,
+            'failed_ops': self.failed_ops,
+            'commits': self.commits,
+            'failed_commits': self.failed_commits,
+            'avg_group': round(self.ops / self.commits, 2) if self.commits else 0.0,
+            'largest_group': self.largest_group
+        }
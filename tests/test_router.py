@@ -0,0 +1,63 @@
+"""
+Intent router: what it routes to a tool, and what it must leave to the model
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "server"))
+from router import IntentRouter
+
+
+@pytest.fixture
+def router():
+    return IntentRouter()
+
+
+@pytest.mark.parametrize("msg, plan", [
+    ("show python books", [("find_books", {"q": "python", "by": "title"})]),
+    ("show all python books", [("find_books", {"q": "python", "by": "title"})]),
+    ("find books by Robert Martin", [("find_books", {"q": "Robert Martin", "by": "author"})]),
+    ("restock Clean Code by 5", [("restock_book", {"isbn": "Clean Code", "qty": 5})]),
+    ("add 10 copies of Clean Code", [("restock_book", {"isbn": "Clean Code", "qty": 10})]),
+    ("update price of Effective Java to 45", [("update_price", {"isbn": "Effective Java", "price": 45.0})]),
+    ("what's the status of order 3?", [("order_status", {"order_id": 3})]),
+    ("show inventory", [("inventory_summary", {})]),
+    ("sell 2 copies of Clean Code to customer 3", [("create_order", {
+        "customer_id": 3, "items": [{"isbn": "Clean Code", "qty": 2}]
+    })]),
+])
+def test_routes_unambiguous_commands(router, msg, plan):
+    assert router.route(msg) == plan
+
+
+@pytest.mark.parametrize("msg", [
+    # Filler captured as the book
+    "show me python books",
+    "find all the python books",
+    "show all books",
+    # Descriptors are not authors or titles
+    "show books by price",
+    # Pronouns need the conversation, and must never become writes
+    "restock it by 5",
+    "update price of it to 10",
+    "sell 2 copies of that to customer 1",
+    # More than one request
+    "restock Clean Code by 5 and show inventory",
+])
+def test_leaves_vague_messages_to_the_model(router, msg):
+    assert router.route(msg) is None
+
+
+@pytest.mark.parametrize("msg, plan", [
+    ("show top selling books", [("sales_report", {"by": "title"})]),
+    ("show me the top-selling titles", [("sales_report", {"by": "title"})]),
+    ("bestsellers", [("sales_report", {"by": "title"})]),
+    ("show best selling authors", [("sales_report", {"by": "author"})]),
+    ("show low stock books", [("inventory_summary", {})]),
+    ("low stock", [("inventory_summary", {})]),
+])
+def test_report_phrasings_reach_report_tools(router, msg, plan):
+    assert router.route(msg) == plan